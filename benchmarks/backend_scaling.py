@@ -0,0 +1,67 @@
+"""Compare how the thread and process backends scale for each target format.
+
+Run from the repository root:
+
+    uv run python -m benchmarks.backend_scaling --images 32 --size 2000
+"""
+
+import argparse
+import itertools
+import time
+from typing import List
+
+from src.converter import ImageConverter, ImageProcessor, get_decoded_cache
+from src.output_cache import get_output_cache
+from src.pools import available_cpus
+from src.scheduler import dedicated_pool
+
+from .corpus import build_corpus
+
+TARGET_FORMATS = ["PNG", "JPEG", "WebP"]
+
+
+def worker_counts(limit: int) -> List[int]:
+    counts = [1]
+    while counts[-1] * 2 <= limit:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != limit:
+        counts.append(limit)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--size", type=int, default=1500)
+    parser.add_argument("--max-workers", type=int, default=available_cpus())
+    args = parser.parse_args()
+
+    uploads = build_corpus(["PNG"], [(args.size, args.size)], args.images)
+    processed = [
+        result.value for result in ImageProcessor.process_images_parallel(uploads)
+    ]
+
+    print(f"{args.images} images of {args.size}x{args.size} px, decode + encode")
+    print(f"{'format':<12}{'backend':<10}{'workers':>8}{'seconds':>10}{'img/s':>10}")
+    for workers, backend in itertools.product(
+        worker_counts(args.max_workers), ("thread", "process")
+    ):
+        # Started before timing, so each run measures warm workers
+        with dedicated_pool(backend, workers):
+            for target_format in TARGET_FORMATS:
+                # Start cold so every run pays for the decode and the encode
+                get_output_cache().clear()
+                get_decoded_cache().clear()
+                start = time.perf_counter()
+                ImageConverter.create_zip(
+                    processed, target_format, backend=backend, max_workers=workers
+                ).close()
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{target_format:<12}{backend:<10}{workers:>8}{elapsed:>10.2f}"
+                    f"{args.images / elapsed:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
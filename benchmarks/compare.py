@@ -0,0 +1,149 @@
+"""Compare benchmark throughput against a stored baseline and flag regressions.
+
+Run from the repository root:
+
+    uv run python -m benchmarks.compare benchmark-results/baseline.json --threshold 10
+
+Without ``--current`` the suite is run now on the baseline's corpus, backends
+and worker counts. The exit status is 1 when any stage's median throughput
+dropped by more than the threshold and the bootstrap confidence interval of
+the change rules out noise.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from .suite import parse_resolution, run_suite
+
+Key = Tuple[str, str, str, int]
+
+
+def throughputs(result: Dict) -> List[float]:
+    return [result["images"] / seconds for seconds in result["seconds"]]
+
+
+def index(report: Dict) -> Dict[Key, Dict]:
+    return {
+        (r["stage"], r["format"], r["backend"], r["workers"]): r
+        for r in report["results"]
+    }
+
+
+def ratio_interval(
+    baseline: List[float],
+    current: List[float],
+    confidence: float = 0.95,
+    resamples: int = 2000,
+) -> Tuple[float, float]:
+    # Percentile bootstrap of the ratio of medians; seeded so a given pair of
+    # reports always gives the same verdict
+    rng = random.Random(0)
+    ratios = sorted(
+        statistics.median(rng.choices(current, k=len(current)))
+        / statistics.median(rng.choices(baseline, k=len(baseline)))
+        for _ in range(resamples)
+    )
+    tail = (1 - confidence) / 2
+    return ratios[int(tail * resamples)], ratios[int((1 - tail) * resamples) - 1]
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[Dict]:
+    rows = []
+    current_results = index(current)
+    for key, base in index(baseline).items():
+        if key not in current_results:
+            continue
+        base_samples = throughputs(base)
+        current_samples = throughputs(current_results[key])
+        ratio = statistics.median(current_samples) / statistics.median(base_samples)
+        low, high = ratio_interval(base_samples, current_samples)
+        rows.append(
+            {
+                "key": key,
+                "baseline": statistics.median(base_samples),
+                "current": statistics.median(current_samples),
+                "ratio": ratio,
+                "interval": (low, high),
+                "regressed": ratio < 1 - threshold and high < 1,
+            }
+        )
+    return rows
+
+
+def rerun(baseline: Dict, repeat: int) -> Dict:
+    keys = index(baseline)
+    return run_suite(
+        argparse.Namespace(
+            formats=baseline["corpus"]["formats"],
+            resolutions=[
+                parse_resolution(value) for value in baseline["corpus"]["resolutions"]
+            ],
+            per_size=baseline["corpus"]["per_size"],
+            max_workers=max(workers for _, _, _, workers in keys),
+            backends=sorted({backend for _, _, backend, _ in keys}),
+            repeat=repeat,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument(
+        "--current", type=Path, help="Compare this report instead of running now"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Allowed throughput drop in percent (default: 10)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", type=Path, help="Write the current run here")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    baseline = json.loads(args.baseline.read_text())
+    if args.current:
+        current = json.loads(args.current.read_text())
+    else:
+        current = rerun(baseline, args.repeat)
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(current, indent=2))
+
+    rows = compare(baseline, current, args.threshold / 100)
+    print(
+        f"\n{'stage':<9}{'fmt':<6}{'backend':<9}{'workers':>8}{'base/s':>10}"
+        f"{'now/s':>10}{'change':>9}  {'95% CI':<17}"
+    )
+    for row in rows:
+        stage, fmt, backend, workers = row["key"]
+        low, high = row["interval"]
+        print(
+            f"{stage:<9}{fmt:<6}{backend:<9}{workers:>8}{row['baseline']:>10.1f}"
+            f"{row['current']:>10.1f}{row['ratio'] - 1:>+9.1%}  "
+            f"[{low - 1:+.1%}, {high - 1:+.1%}]"
+            f"{'  REGRESSION' if row['regressed'] else ''}"
+        )
+
+    regressions = [row for row in rows if row["regressed"]]
+    if regressions:
+        print(
+            f"\n{len(regressions)} of {len(rows)} stages regressed by more than "
+            f"{args.threshold:g}%"
+        )
+        sys.exit(1)
+    print(f"\nNo stage regressed by more than {args.threshold:g}%")
+
+
+if __name__ == "__main__":
+    main()
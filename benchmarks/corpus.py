@@ -0,0 +1,58 @@
+"""Deterministic synthetic images for the benchmarks."""
+
+import io
+import random
+from typing import List, Sequence, Tuple
+
+import pillow_heif
+from PIL import Image
+
+SOURCE_FORMATS = ["PNG", "JPEG", "WebP", "HEIC"]
+RESOLUTIONS = [(640, 480), (1920, 1080), (4032, 3024)]
+
+# Pillow's save() names for the source formats that differ from the extension
+_SAVE_FORMATS = {"HEIC": "HEIF"}
+
+
+def synthetic_image(size: Tuple[int, int], seed: int) -> Image.Image:
+    # Seeded low-resolution noise, upscaled and mixed with gradients: stable
+    # across runs and close enough to a photo to give the codecs real work
+    width, height = size
+    rng = random.Random(seed)
+    tile = (max(width // 16, 1), max(height // 16, 1))
+    noise = Image.frombytes("L", tile, rng.randbytes(tile[0] * tile[1]))
+    noise = noise.resize(size, Image.BICUBIC)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge(
+        "RGB", (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT))
+    )
+
+
+def encode_sample(image: Image.Image, source_format: str, name: str) -> io.BytesIO:
+    pillow_heif.register_heif_opener()
+    sample = io.BytesIO()
+    image.save(sample, format=_SAVE_FORMATS.get(source_format, source_format))
+    sample.name = name
+    sample.seek(0)
+    return sample
+
+
+def build_corpus(
+    formats: Sequence[str] = SOURCE_FORMATS,
+    resolutions: Sequence[Tuple[int, int]] = RESOLUTIONS,
+    per_size: int = 2,
+) -> List[io.BytesIO]:
+    samples = []
+    for width, height in resolutions:
+        for index in range(per_size):
+            image = synthetic_image((width, height), seed=width * height + index)
+            for source_format in formats:
+                extension = source_format.lower()
+                name = f"{width}x{height}_{index}_{extension}.{extension}"
+                samples.append(encode_sample(image, source_format, name))
+    return samples
+
+
+def source_format(sample: io.BytesIO) -> str:
+    extension = sample.name.rsplit(".", 1)[-1].upper()
+    return next(fmt for fmt in SOURCE_FORMATS if fmt.upper() == extension)
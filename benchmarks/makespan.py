@@ -0,0 +1,62 @@
+"""Compare upload order with longest-first ordering on a mixed-size batch.
+
+Run from the repository root:
+
+    uv run python -m benchmarks.makespan --workers 4 --small 24 --large 1
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from src.converter import ImageConverter, ImageProcessor, get_decoded_cache
+from src.output_cache import get_output_cache
+from src.pools import available_cpus
+from src.scheduler import dedicated_pool
+from src.settings import ORDERINGS, get_settings
+
+from .corpus import build_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=available_cpus())
+    parser.add_argument("--small", type=int, default=24)
+    parser.add_argument("--large", type=int, default=1)
+    parser.add_argument("--large-size", type=int, default=7000)
+    parser.add_argument("--format", default="PNG")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # The large images come last, as a panorama uploaded after the photos would
+    uploads = build_corpus(["JPEG"], [(1280, 960)], args.small) + build_corpus(
+        ["JPEG"], [(args.large_size, args.large_size // 2)], args.large
+    )
+    processed = [
+        result.value for result in ImageProcessor.process_images_parallel(uploads)
+    ]
+
+    print(
+        f"{args.small} small + {args.large} large images to {args.format}, "
+        f"{args.workers} workers, median of {args.repeat}"
+    )
+    # Started before timing, so both orderings see the same warm workers
+    with dedicated_pool(get_settings().backend, args.workers):
+        for order in ORDERINGS:
+            os.environ["ST_CONVERTER_ORDER"] = order
+            get_settings.cache_clear()
+            runs = []
+            for _ in range(args.repeat):
+                get_output_cache().clear()
+                get_decoded_cache().clear()
+                start = time.perf_counter()
+                ImageConverter.create_zip(
+                    processed, args.format, max_workers=args.workers
+                ).close()
+                runs.append(time.perf_counter() - start)
+            print(f"{order:<10}{statistics.median(runs):>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
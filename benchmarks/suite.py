@@ -0,0 +1,276 @@
+"""Decode, encode and archive throughput per format, written as JSON.
+
+Run from the repository root:
+
+    uv run python -m benchmarks.suite --max-workers 8 --repeat 3
+
+Every run uses the same seeded synthetic corpus, so result files from
+different builds can be compared directly.
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import PIL
+import pillow_heif
+from loguru import logger
+
+from src.converter import (
+    TARGET_FORMATS,
+    ImageConverter,
+    ImageProcessor,
+    get_decoded_cache,
+)
+from src.memory import PeakRSSSampler
+from src.output_cache import get_output_cache
+from src.pools import available_cpus
+from src.scheduler import dedicated_pool
+from src.settings import BACKENDS
+
+from .backend_scaling import worker_counts
+from .corpus import RESOLUTIONS, SOURCE_FORMATS, build_corpus, source_format
+
+MEGABYTE = 1024 * 1024
+
+
+def decode_sample(name: str, data: bytes) -> int:
+    image = ImageProcessor.decode(name, data)
+    return image.width * image.height * len(image.getbands())
+
+
+def measure(run: Callable[[], None], repeat: int) -> Tuple[List[float], int]:
+    seconds = []
+    peak_rss = 0
+    for _ in range(repeat):
+        get_output_cache().clear()
+        with PeakRSSSampler() as sampler:
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        peak_rss = max(peak_rss, sampler.peak)
+    return seconds, peak_rss
+
+
+def record(
+    stage: str,
+    fmt: str,
+    backend: str,
+    workers: int,
+    images: int,
+    nbytes: int,
+    seconds: List[float],
+    peak_rss: int,
+) -> Dict:
+    median = statistics.median(seconds)
+    result = {
+        "stage": stage,
+        "format": fmt,
+        "backend": backend,
+        "workers": workers,
+        "images": images,
+        "bytes": nbytes,
+        "seconds": seconds,
+        "median_seconds": median,
+        "images_per_s": images / median,
+        "mb_per_s": nbytes / MEGABYTE / median,
+        "peak_rss_bytes": peak_rss,
+    }
+    print(
+        f"{stage:<9}{fmt:<6}{backend:<9}{workers:>8}{median:>10.3f}"
+        f"{result['images_per_s']:>10.1f}{result['mb_per_s']:>10.1f}"
+        f"{peak_rss / MEGABYTE:>10.0f}"
+    )
+    return result
+
+
+def run_suite(args: argparse.Namespace) -> Dict:
+    corpus = build_corpus(args.formats, args.resolutions, args.per_size)
+    processed = [
+        result.value for result in ImageProcessor.process_images_parallel(corpus)
+    ]
+    by_format = {fmt: [] for fmt in args.formats}
+    for sample, image in zip(corpus, processed):
+        by_format[source_format(sample)].append(image)
+
+    # Encode from one lossless copy of every picture; the pixels are the same
+    # whichever format they were stored in
+    encode_sources = by_format["PNG" if "PNG" in by_format else args.formats[0]]
+    decoded = [image.decode() for image in encode_sources]
+    decoded_bytes = sum(
+        image.width * image.height * len(image.getbands()) for image in decoded
+    )
+
+    print(f"{len(corpus)} samples, {sum(len(s.getbuffer()) for s in corpus)} bytes")
+    print(
+        f"{'stage':<9}{'fmt':<6}{'backend':<9}{'workers':>8}{'median s':>10}"
+        f"{'img/s':>10}{'MB/s':>10}{'peak MB':>10}"
+    )
+    results = []
+    pools = []
+    for workers, backend in itertools.product(
+        worker_counts(args.max_workers), args.backends
+    ):
+        # Every stage runs on one pool per worker count and backend, started
+        # before anything is timed; its start-up time is reported on its own
+        start = time.perf_counter()
+        with dedicated_pool(backend, workers) as executor:
+            pool_start = time.perf_counter() - start
+            print(f"{'pool':<9}{'':<6}{backend:<9}{workers:>8}{pool_start:>10.3f}")
+            pools.append(
+                {"backend": backend, "workers": workers, "start_seconds": pool_start}
+            )
+            for fmt, images in by_format.items():
+
+                def decode():
+                    list(
+                        executor.map(
+                            decode_sample,
+                            [image.original_name for image in images],
+                            [image.data for image in images],
+                        )
+                    )
+
+                seconds, peak = measure(decode, args.repeat)
+                nbytes = sum(len(image.data) for image in images)
+                results.append(
+                    record(
+                        "decode",
+                        fmt,
+                        backend,
+                        workers,
+                        len(images),
+                        nbytes,
+                        seconds,
+                        peak,
+                    )
+                )
+
+            # Keep every decoded bitmap resident so only the encode is timed
+            decoded_cache = get_decoded_cache()
+            decoded_cache.max_bytes = max(decoded_cache.max_bytes, decoded_bytes * 2)
+            for image, pixels in zip(encode_sources, decoded):
+                decoded_cache.put(image.content_hash, pixels)
+            for target_format in TARGET_FORMATS:
+
+                def encode():
+                    futures = [
+                        ImageConverter.submit_conversion(
+                            executor, backend, image, target_format
+                        )
+                        for image in encode_sources
+                    ]
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+
+                seconds, peak = measure(encode, args.repeat)
+                results.append(
+                    record(
+                        "encode",
+                        target_format,
+                        backend,
+                        workers,
+                        len(encode_sources),
+                        decoded_bytes,
+                        seconds,
+                        peak,
+                    )
+                )
+
+            for target_format in TARGET_FORMATS:
+                archive_bytes = []
+
+                def archive():
+                    # Cold caches: decode, encode and ZIP write of the whole corpus
+                    get_decoded_cache().clear()
+                    zip_archive = ImageConverter.create_zip(
+                        processed, target_format, backend=backend, max_workers=workers
+                    )
+                    archive_bytes.append(zip_archive.size)
+                    zip_archive.close()
+
+                seconds, peak = measure(archive, args.repeat)
+                results.append(
+                    record(
+                        "archive",
+                        target_format,
+                        backend,
+                        workers,
+                        len(processed),
+                        archive_bytes[-1],
+                        seconds,
+                        peak,
+                    )
+                )
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "pillow_heif": pillow_heif.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "available_cpus": available_cpus(),
+            "repeat": args.repeat,
+        },
+        "corpus": {
+            "formats": args.formats,
+            "resolutions": [f"{width}x{height}" for width, height in args.resolutions],
+            "per_size": args.per_size,
+            "samples": len(corpus),
+        },
+        "pools": pools,
+        "results": results,
+    }
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--formats", nargs="+", choices=SOURCE_FORMATS, default=SOURCE_FORMATS
+    )
+    parser.add_argument(
+        "--resolutions", nargs="+", type=parse_resolution, default=RESOLUTIONS
+    )
+    parser.add_argument("--per-size", type=int, default=2)
+    parser.add_argument("--max-workers", type=int, default=available_cpus())
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["thread"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="JSON file to write (default: benchmark-results/<timestamp>.json)",
+    )
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    report = run_suite(args)
+    output = args.output or Path("benchmark-results") / (
+        datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 import streamlit as st
 
 from src import render_home_page, render_image_converter
+from src.logs import setup_logging
+from src.metrics import start_exporter
+from src.pressure import start_pressure_monitor
+from src.startup import start_warm_up
 
 
 # Main app code
 def main():
+    setup_logging()
+    start_warm_up()
+    start_pressure_monitor()
+    start_exporter()
     st.set_page_config(layout="wide")
 
     # Add CSS for centered text
@@ -1,4 +1,16 @@
-from .homepage import render_home_page
-from .image_converter import render_image_converter
+__all__ = ["render_home_page", "render_image_converter"]
 
-__all__ = ["render_home_page", "render_image_converter"] 
\ No newline at end of file
+
+# Page entry points import their module on first render, so starting the
+# server or visiting the homepage does not load the codecs, and the headless
+# CLI can import the conversion core without pulling in Streamlit
+def render_home_page():
+    from .homepage import render_home_page
+
+    render_home_page()
+
+
+def render_image_converter():
+    from .image_converter import render_image_converter
+
+    render_image_converter()
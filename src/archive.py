@@ -0,0 +1,95 @@
+import io
+import os
+import tempfile
+import threading
+import weakref
+import zipfile
+from pathlib import Path
+from typing import BinaryIO
+
+# Finished archives still held in memory, which spill_archives() can move to disk
+_finished: "weakref.WeakSet[SpooledArchive]" = weakref.WeakSet()
+_finished_lock = threading.Lock()
+
+
+class SpooledArchive:
+    """ZIP archive that stays in memory up to ``max_memory`` bytes, then spills to disk."""
+
+    def __init__(self, max_memory: int):
+        self._spool = tempfile.SpooledTemporaryFile(
+            max_size=max_memory, prefix="st-converter-", suffix=".zip"
+        )
+        self._zip = zipfile.ZipFile(self._spool, "w", allowZip64=True)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "SpooledArchive":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.close()
+
+    def writestr(self, name: str, data: bytes) -> None:
+        self._zip.writestr(name, data)
+
+    def finish(self) -> None:
+        self._zip.close()
+        if not self.on_disk:
+            with _finished_lock:
+                _finished.add(self)
+
+    @property
+    def size(self) -> int:
+        return self._spool.seek(0, io.SEEK_END)
+
+    @property
+    def on_disk(self) -> bool:
+        return self._spool._rolled
+
+    def reader(self) -> BinaryIO:
+        with self._lock:
+            if not self.on_disk:
+                # Bounded by max_memory, so a copy is cheap
+                return io.BytesIO(self._spool._file.getvalue())
+            # Stream straight from the temp file rather than copying it into memory.
+            # The duplicate shares the spool's offset, which writing left at the end
+            reader = open(os.dup(self._spool.fileno()), "rb")
+            reader.seek(0)
+            return reader
+
+    def spill(self) -> int:
+        """Move a finished in-memory archive to disk; returns the bytes freed."""
+        with self._lock:
+            if self.on_disk or self._spool.closed:
+                return 0
+            size = self.size
+            self._spool.rollover()
+            return size
+
+    def close(self) -> None:
+        self._zip.close()
+        with self._lock:
+            self._spool.close()
+
+
+def spill_archives() -> int:
+    with _finished_lock:
+        archives = list(_finished)
+        _finished.clear()
+    return sum(archive.spill() for archive in archives)
+
+
+class DirectoryWriter:
+    """Writes entries as files under ``root``, mirroring the ZipFile.writestr API."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+
+    def writestr(self, name: str, data: bytes) -> None:
+        path = (self.root / name).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Refusing to write outside {self.root}: {name}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
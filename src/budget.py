@@ -0,0 +1,28 @@
+import threading
+
+
+class MemoryBudget:
+    """Blocks callers until the bytes they want to reserve fit under ``limit``."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self, amount: int) -> int:
+        with self._condition:
+            # A single item bigger than the whole budget still gets to run alone
+            self._condition.wait_for(
+                lambda: self._in_flight == 0 or self._in_flight + amount <= self.limit
+            )
+            self._in_flight += amount
+            return amount
+
+    def release(self, amount: int) -> None:
+        with self._condition:
+            self._in_flight -= amount
+            self._condition.notify_all()
@@ -0,0 +1,163 @@
+import argparse
+import io
+import sys
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .archive import DirectoryWriter
+from .converter import SUPPORTED_EXTENSIONS, TARGET_FORMATS, ImageConverter
+from .logs import configure_logging
+from .settings import BACKENDS
+from .startup import APP_MODULES, import_report
+from .tracing import trace
+
+
+class _CountingSink:
+    def __init__(self, sink):
+        self.sink = sink
+        self.bytes_written = 0
+
+    def writestr(self, name: str, data: bytes) -> None:
+        self.sink.writestr(name, data)
+        self.bytes_written += len(data)
+
+
+def discover(inputs: List[Path]) -> List[Tuple[Path, str]]:
+    # Files found in a directory keep their path relative to it, so the output
+    # mirrors the input tree
+    sources = []
+    for root in inputs:
+        if root.is_file():
+            sources.append((root, root.name))
+            continue
+        for path in sorted(root.rglob("*")):
+            if (
+                path.is_file()
+                and path.suffix.lower().lstrip(".") in SUPPORTED_EXTENSIONS
+            ):
+                sources.append((path, path.relative_to(root).as_posix()))
+    return sources
+
+
+def load(sources: List[Tuple[Path, str]]) -> Iterator[io.BytesIO]:
+    for path, name in sources:
+        file = io.BytesIO(path.read_bytes())
+        file.name = name
+        yield file
+
+
+def convert(args: argparse.Namespace) -> int:
+    target_format = next(
+        fmt for fmt in TARGET_FORMATS if fmt.lower() == args.to.lower()
+    )
+    sources = discover(args.inputs)
+    if not sources:
+        print("No supported images found", file=sys.stderr)
+        return 1
+    bytes_read = sum(path.stat().st_size for path, _ in sources)
+
+    failures = []
+    start = time.perf_counter()
+    with trace("cli_convert", files=len(sources), output=str(args.output)):
+        if args.output.suffix.lower() == ".zip":
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(args.output, "w", allowZip64=True) as archive:
+                sink = _CountingSink(archive)
+                written = ImageConverter.stream_conversions(
+                    load(sources),
+                    target_format,
+                    sink,
+                    args.backend,
+                    args.workers,
+                    failures=failures,
+                )
+        else:
+            sink = _CountingSink(DirectoryWriter(args.output))
+            written = ImageConverter.stream_conversions(
+                load(sources),
+                target_format,
+                sink,
+                args.backend,
+                args.workers,
+                failures=failures,
+            )
+    elapsed = time.perf_counter() - start
+
+    megabytes = 1024 * 1024
+    print(
+        f"Converted {written}/{len(sources)} files to {target_format} "
+        f"in {elapsed:.2f} s: {written / elapsed:.1f} images/s, "
+        f"{bytes_read / megabytes / elapsed:.1f} MB/s in, "
+        f"{sink.bytes_written / megabytes / elapsed:.1f} MB/s out"
+    )
+    for failure in failures:
+        print(f"Failed {failure.name}: {failure.error}", file=sys.stderr)
+    return 0 if written == len(sources) else 1
+
+
+def imports(args: argparse.Namespace) -> int:
+    print(import_report(args.modules, args.top))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="st-converter", description="File conversion tools"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="Convert images in files or directory trees"
+    )
+    convert_parser.add_argument(
+        "inputs", nargs="+", type=Path, help="Image files or directories to walk"
+    )
+    convert_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        required=True,
+        help="Target directory, or a path ending in .zip to write an archive",
+    )
+    convert_parser.add_argument(
+        "-t",
+        "--to",
+        required=True,
+        type=str.lower,
+        choices=[fmt.lower() for fmt in TARGET_FORMATS],
+        help="Target format",
+    )
+    convert_parser.add_argument(
+        "-w", "--workers", type=int, help="Worker count (default: usable CPUs)"
+    )
+    convert_parser.add_argument(
+        "-b", "--backend", choices=BACKENDS, help="Worker backend (default: thread)"
+    )
+    convert_parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Log every file"
+    )
+    convert_parser.set_defaults(handler=convert)
+
+    imports_parser = subparsers.add_parser(
+        "imports", help="Report the import time of each app module"
+    )
+    imports_parser.add_argument(
+        "modules", nargs="*", default=APP_MODULES, help="Modules to import"
+    )
+    imports_parser.add_argument(
+        "--top", type=int, default=5, help="Direct imports to list per module"
+    )
+    imports_parser.set_defaults(handler=imports, verbose=False)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    configure_logging("DEBUG" if args.verbose else "WARNING")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,749 @@
+import concurrent.futures
+import functools
+import io
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+from PIL import Image
+
+from .archive import SpooledArchive
+from .budget import MemoryBudget
+from .cost import conversion_cost, longest_first
+from .fingerprint import fingerprint
+from .metrics import (
+    QUEUE_DEPTH,
+    record_conversion,
+    record_error,
+    track_cache,
+    track_conversion,
+    write_textfile,
+)
+from .output_cache import ByteBudgetLRU, get_output_cache, make_key
+from .quota import get_quotas
+from .scheduler import (
+    STATUS_INTERVAL,
+    as_completed,
+    current_session,
+    get_scheduler,
+    report_status,
+    worker_pool,
+)
+from .settings import get_settings
+from .shared_image import SharedImageHandle, export_image, import_image, release
+from .timing import BatchTimings, FileTiming
+from .tracing import (
+    SpanContext,
+    bind,
+    current_context,
+    current_trace_id,
+    resume,
+    span,
+)
+
+SUPPORTED_EXTENSIONS = ["png", "jpg", "jpeg", "webp", "heic"]
+TARGET_FORMATS = ["PNG", "JPEG", "WebP"]
+# Used for sessions past their soft quota; JPEG's defaults are already fast
+FAST_ENCODER_OPTIONS = {"PNG": {"compress_level": 1}, "WebP": {"method": 0}}
+
+
+@functools.lru_cache(maxsize=None)
+def get_decoded_cache() -> ByteBudgetLRU:
+    cache = ByteBudgetLRU(get_settings().decoded_cache_bytes, sizeof=_image_nbytes)
+    track_cache("decoded", cache)
+    return cache
+
+
+def _image_nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class ProcessedImage:
+    """Compressed upload plus header metadata; pixels are decoded on demand."""
+
+    __slots__ = ("original_name", "data", "content_hash", "size", "mode", "format")
+
+    def __init__(
+        self,
+        original_name: str,
+        data: bytes,
+        content_hash: Optional[str] = None,
+        size: Tuple[int, int] = (0, 0),
+        mode: str = "",
+        format: Optional[str] = None,
+    ):
+        self.original_name = original_name
+        self.data = data
+        self.content_hash = content_hash
+        self.size = size
+        self.mode = mode
+        self.format = format
+
+    def __repr__(self) -> str:
+        return (
+            f"ProcessedImage({self.original_name!r}, {self.format} "
+            f"{self.size[0]}x{self.size[1]} {self.mode}, {len(self.data)} bytes)"
+        )
+
+    @property
+    def cached_image(self) -> Optional[Image.Image]:
+        if self.content_hash is None:
+            return None
+        return get_decoded_cache().get(self.content_hash)
+
+    @property
+    def image(self) -> Image.Image:
+        # Recently used bitmaps stay in a small shared LRU; the rest are
+        # decoded again from the compressed bytes when needed
+        image = self.cached_image
+        if image is None:
+            image = self.decode()
+            if self.content_hash is not None:
+                get_decoded_cache().put(self.content_hash, image)
+        return image
+
+    def decode(self) -> Image.Image:
+        return ImageProcessor.decode(self.original_name, self.data)
+
+    def renamed(self, original_name: str) -> "ProcessedImage":
+        return ProcessedImage(
+            original_name,
+            self.data,
+            self.content_hash,
+            self.size,
+            self.mode,
+            self.format,
+        )
+
+
+@dataclass
+class FileResult:
+    """Outcome of one file in a batch: the processed image, or why it failed."""
+
+    name: str
+    value: Optional[ProcessedImage] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class ImageProcessor:
+    @staticmethod
+    def process_heic(file) -> Image.Image:
+        # Imported on first use: loading libheif is the costliest import here,
+        # and the warm-up thread usually pays for it before any upload
+        import pillow_heif
+
+        logger.debug("Processing HEIC file: {}", file.name)
+        heif_file = pillow_heif.read_heif(file)
+        return Image.frombytes(
+            heif_file.mode,
+            heif_file.size,
+            heif_file.data,
+            "raw",
+            heif_file.mode,
+            heif_file.stride,
+        )
+
+    @staticmethod
+    def decode(name: str, data: bytes) -> Image.Image:
+        source = io.BytesIO(data)
+        source.name = name
+        if name.lower().endswith(".heic"):
+            with span("decode", file=name, decoder="heic"):
+                return ImageProcessor.process_heic(source)
+        with span("decode", file=name, decoder="pillow"):
+            image = Image.open(source)
+            image.load()
+            return image
+
+    @staticmethod
+    def read_header(file) -> Tuple[Tuple[int, int], str, str]:
+        # Header-only probe: neither path decodes any pixels
+        try:
+            if file.name.lower().endswith(".heic"):
+                import pillow_heif
+
+                heif_file = pillow_heif.open_heif(file)
+                return heif_file.size, heif_file.mode, "HEIF"
+            with Image.open(file) as image:
+                return image.size, image.mode, image.format
+        finally:
+            file.seek(0)
+
+    @staticmethod
+    def process_image(file, content_hash: Optional[str] = None) -> ProcessedImage:
+        with span("process_image", file=file.name):
+            try:
+                size, mode, image_format = ImageProcessor.read_header(file)
+                logger.debug(
+                    "Processed {}: {} {}x{} {}",
+                    file.name,
+                    image_format,
+                    size[0],
+                    size[1],
+                    mode,
+                )
+                return ProcessedImage(
+                    file.name,
+                    file.getvalue(),
+                    content_hash or fingerprint(file),
+                    size,
+                    mode,
+                    image_format,
+                )
+            except Exception as e:
+                logger.error("Error processing {}: {}", file.name, e)
+                record_error(file.name)
+                raise
+
+    @staticmethod
+    def estimate_decoded_bytes(file) -> int:
+        try:
+            (width, height), mode, _ = ImageProcessor.read_header(file)
+        except Exception as e:
+            logger.warning("Could not read header of {}: {}", file.name, e)
+            return 0
+        return width * height * Image.getmodebands(mode)
+
+    @staticmethod
+    def process_images_parallel(
+        files,
+        max_workers: Optional[int] = None,
+        fingerprints: Optional[List[str]] = None,
+    ) -> List[FileResult]:
+        """Probe every file; returns one result per file, in upload order.
+
+        A file that fails is reported in its result rather than raised, so the
+        rest of the batch is kept. ``fingerprints`` are the files' content
+        hashes when the caller already has them; otherwise each file is hashed.
+        """
+        # Only headers are read here, so threads are enough whatever the
+        # backend; pixels are decoded when an encoder or the gallery needs them
+        get_quotas().check(current_session())
+        get_scheduler().wait_admitted()
+        start = time.perf_counter()
+        with (
+            span("process_images", images=len(files)),
+            worker_pool("thread", max_workers) as executor,
+        ):
+            # No header is read yet, so go by upload size, which hashing scales with
+            order = range(len(files))
+            if get_settings().order == "cost":
+                order = longest_first(order, lambda i: len(files[i].getvalue()))
+            futures = [None] * len(files)
+            for i in order:
+                futures[i] = executor.submit(
+                    bind(ImageProcessor.process_image),
+                    files[i],
+                    fingerprints[i] if fingerprints else None,
+                )
+            # Wait in completion order, which reports the queue position
+            for _ in as_completed(futures):
+                pass
+            results = [
+                (
+                    FileResult(file.name, error=str(future.exception()))
+                    if future.exception() is not None
+                    else FileResult(file.name, future.result())
+                )
+                for file, future in zip(files, futures)
+            ]
+        failed = sum(not result.ok for result in results)
+        logger.info(
+            "Processed {} images in {:.2f} s, {} failed",
+            len(files),
+            time.perf_counter() - start,
+            failed,
+        )
+        get_quotas().log_usage(current_session())
+        return results
+
+    @staticmethod
+    def process_images_incremental(
+        files, fingerprints: List[str], known: Dict[str, ProcessedImage], **kwargs
+    ) -> List[FileResult]:
+        # Failed files are not added to ``known``, so calling this again with
+        # the same uploads retries just those
+        pending = {}
+        for file, content_hash in zip(files, fingerprints):
+            if content_hash not in known:
+                pending.setdefault(content_hash, file)
+        logger.info(
+            f"Processing {len(pending)} new of {len(files)} images, "
+            f"reusing {len(known)} already processed"
+        )
+        errors = {}
+        if pending:
+            results = ImageProcessor.process_images_parallel(
+                list(pending.values()), fingerprints=list(pending), **kwargs
+            )
+            for content_hash, result in zip(pending, results):
+                if result.ok:
+                    known[content_hash] = result.value
+                else:
+                    errors[content_hash] = result.error
+
+        # Identical bytes uploaded under a new name reuse the earlier work
+        return [
+            (
+                FileResult(file.name, known[content_hash].renamed(file.name))
+                if content_hash in known
+                else FileResult(file.name, error=errors[content_hash])
+            )
+            for file, content_hash in zip(files, fingerprints)
+        ]
+
+
+class ImageConverter:
+    @staticmethod
+    def output_name(original_name: str, target_format: str) -> str:
+        # Keeps any directory part, which the CLI uses to mirror input trees
+        return Path(original_name).with_suffix(f".{target_format.lower()}").as_posix()
+
+    @staticmethod
+    def encode(
+        image: Image.Image, target_format: str, options: Optional[Dict[str, Any]] = None
+    ) -> bytes:
+        img_buffer = io.BytesIO()
+        image.save(img_buffer, format=target_format, **(options or {}))
+        return img_buffer.getvalue()
+
+    @staticmethod
+    def timed_encode(
+        image: Image.Image,
+        timing: FileTiming,
+        target_format: str,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[str, bytes, FileTiming]:
+        start = time.perf_counter()
+        with span("encode", file=timing.name, format=target_format):
+            image_data = ImageConverter.encode(image, target_format, options)
+        timing.encode = time.perf_counter() - start
+        timing.bytes_out = len(image_data)
+        timing.decoded_bytes = image.width * image.height * len(image.getbands())
+        new_name = ImageConverter.output_name(timing.name, target_format)
+        return new_name, image_data, timing
+
+    @staticmethod
+    def convert_to_buffer(
+        processed_image: ProcessedImage,
+        target_format: str,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[str, bytes, FileTiming]:
+        timing = FileTiming(
+            processed_image.original_name, bytes_in=len(processed_image.data)
+        )
+        with span("convert", file=timing.name), track_conversion(timing.name):
+            start = time.perf_counter()
+            image = processed_image.image
+            timing.decode = time.perf_counter() - start
+            result = ImageConverter.timed_encode(image, timing, target_format, options)
+        record_conversion(target_format, timing)
+        return result
+
+    @staticmethod
+    def convert_file(
+        file, target_format: str, options: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, bytes, FileTiming]:
+        # Bypasses the decoded-image LRU: the bitmap is freed as soon as the
+        # encoded bytes are returned. The caller has already hashed the file and
+        # read its header, so this goes straight to decoding
+        with span("convert", file=file.name), track_conversion(file.name):
+            start = time.perf_counter()
+            data = file.getvalue()
+            image = ImageProcessor.decode(file.name, data)
+            timing = FileTiming(
+                file.name, decode=time.perf_counter() - start, bytes_in=len(data)
+            )
+            result = ImageConverter.timed_encode(image, timing, target_format, options)
+        record_conversion(target_format, timing)
+        return result
+
+    @staticmethod
+    def admit(
+        session: str, target_format: str, options: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Refuse a session past its hard quota; past the soft one, encode faster.
+
+        Returns the encoder options to use.
+        """
+        quotas = get_quotas()
+        quotas.check(session)
+        if quotas.over_soft(session) and target_format in FAST_ENCODER_OPTIONS:
+            logger.info(
+                f"Session {session} is over its soft quota, "
+                f"using fast {target_format} encoder settings"
+            )
+            return {**FAST_ENCODER_OPTIONS[target_format], **(options or {})}
+        return options
+
+    @staticmethod
+    def submit_conversion(
+        executor: concurrent.futures.Executor,
+        backend: str,
+        processed_image: ProcessedImage,
+        target_format: str,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> concurrent.futures.Future:
+        QUEUE_DEPTH.inc()
+        if backend != "process":
+            future = executor.submit(
+                bind(ImageConverter.convert_to_buffer),
+                processed_image,
+                target_format,
+                options,
+            )
+        else:
+            image = processed_image.cached_image
+            if image is None:
+                # Compressed bytes are far smaller than pixels; let the worker decode
+                future = executor.submit(
+                    _convert_source,
+                    processed_image.original_name,
+                    processed_image.data,
+                    target_format,
+                    options,
+                    current_context(),
+                    current_trace_id(),
+                )
+            else:
+                handle = export_image(image)
+                future = executor.submit(
+                    _encode_from_shared,
+                    handle,
+                    processed_image.original_name,
+                    target_format,
+                    options,
+                    current_context(),
+                    current_trace_id(),
+                )
+                future.add_done_callback(lambda _: release(handle))
+        future.add_done_callback(lambda _: QUEUE_DEPTH.dec())
+        return future
+
+    @staticmethod
+    def create_zip(
+        processed_images: List[ProcessedImage],
+        target_format: str,
+        backend: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timings: Optional[BatchTimings] = None,
+        failures: Optional[List[FileResult]] = None,
+    ) -> SpooledArchive:
+        """Encode every image into a spooled ZIP.
+
+        Per-file stage timings are added to ``timings`` and files that could
+        not be converted to ``failures``, when given.
+        """
+        settings = get_settings()
+        backend = backend or settings.backend
+        logger.info(
+            f"Creating ZIP with {len(processed_images)} images in {target_format} format"
+            f" ({backend} backend)"
+        )
+        session = current_session()
+        options = ImageConverter.admit(session, target_format, options)
+        get_scheduler().wait_admitted()
+        cache = get_output_cache()
+        cache_hits = 0
+        failed = 0
+        start = time.perf_counter()
+        with (
+            span(
+                "create_zip",
+                format=target_format,
+                backend=backend,
+                images=len(processed_images),
+            ),
+            SpooledArchive(settings.zip_spool_bytes) as archive,
+        ):
+            order = processed_images
+            if settings.order == "cost":
+                order = longest_first(
+                    processed_images,
+                    lambda img: conversion_cost(img.size, img.format, target_format),
+                )
+            with worker_pool(backend, max_workers) as executor:
+                futures = {}
+                for img in order:
+                    key = None
+                    if img.content_hash is not None:
+                        key = make_key(img.content_hash, target_format, options)
+                        cached = cache.get(key)
+                        if cached is not None:
+                            new_name = ImageConverter.output_name(
+                                img.original_name, target_format
+                            )
+                            write_start = time.perf_counter()
+                            with span("zip_append", file=new_name, cached=True):
+                                archive.writestr(new_name, cached)
+                            if timings is not None:
+                                timings.add(
+                                    FileTiming(
+                                        img.original_name,
+                                        zip_write=time.perf_counter() - write_start,
+                                        bytes_in=len(img.data),
+                                        bytes_out=len(cached),
+                                        cached=True,
+                                    )
+                                )
+                            cache_hits += 1
+                            logger.debug("Added cached {} to ZIP", new_name)
+                            continue
+                    future = ImageConverter.submit_conversion(
+                        executor, backend, img, target_format, options
+                    )
+                    futures[future] = (key, img)
+                for future in as_completed(futures):
+                    key, img = futures[future]
+                    try:
+                        new_name, image_data, timing = future.result()
+                        timing.bytes_in = len(img.data)
+                        write_start = time.perf_counter()
+                        with span("zip_append", file=new_name, cached=False):
+                            archive.writestr(new_name, image_data)
+                        timing.zip_write = time.perf_counter() - write_start
+                        if timings is not None:
+                            timings.add(timing)
+                        get_quotas().charge(session, decoded_bytes=timing.decoded_bytes)
+                        if backend == "process":
+                            # Worker processes keep their own, unexported metrics
+                            record_conversion(target_format, timing)
+                        if key is not None:
+                            cache.put(key, image_data)
+                        logger.debug("Added {} to ZIP", new_name)
+                    except Exception as e:
+                        failed += 1
+                        logger.error("Error adding {} to ZIP: {}", img.original_name, e)
+                        if failures is not None:
+                            failures.append(FileResult(img.original_name, error=str(e)))
+                        if backend == "process":
+                            record_error(img.original_name)
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings.wall = elapsed
+
+        write_textfile()
+
+        stats = cache.stats()
+        logger.success(
+            f"ZIP file created in {elapsed:.2f} s ({archive.size} bytes"
+            f"{', spooled to disk' if archive.on_disk else ''}, "
+            f"{cache_hits}/{len(processed_images)} served from cache, "
+            f"{failed} failed; cache totals: {stats.hits} hits, "
+            f"{stats.misses} misses, {stats.bytes}/{stats.max_bytes} bytes)"
+        )
+        get_quotas().log_usage(session)
+        return archive
+
+    @staticmethod
+    def stream_conversions(
+        files: Iterable,
+        target_format: str,
+        sink,
+        backend: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timings: Optional[BatchTimings] = None,
+        failures: Optional[List[FileResult]] = None,
+        fingerprints: Optional[List[str]] = None,
+    ) -> int:
+        """Decode, encode and ``sink.writestr`` each file; returns how many were written.
+
+        ``files`` may be a lazy iterable: a file is only read once the in-flight
+        memory budget has room for it. Per-file stage timings are added to
+        ``timings`` and files that could not be converted to ``failures``, when
+        given. ``fingerprints`` are the files' content hashes when the caller
+        already has them; otherwise each file is hashed.
+        """
+        settings = get_settings()
+        backend = backend or settings.backend
+        session = current_session()
+        options = ImageConverter.admit(session, target_format, options)
+        get_scheduler().wait_admitted()
+        budget = MemoryBudget(settings.pipeline_memory_bytes)
+        cache = get_output_cache()
+        write_lock = threading.Lock()
+        # The pool is shared, so wait on our own callbacks rather than its shutdown
+        idle = threading.Condition()
+        outstanding = 0
+        written = 0
+        failed = 0
+        submitted = 0
+        start = time.perf_counter()
+        logger.info(
+            f"Streaming images to {target_format} ({backend} backend, "
+            f"{budget.limit} byte in-flight budget)"
+        )
+
+        def write(new_name, image_data, timing):
+            nonlocal written
+            with write_lock:
+                write_start = time.perf_counter()
+                with span("zip_append", file=new_name, cached=timing.cached):
+                    sink.writestr(new_name, image_data)
+                timing.zip_write = time.perf_counter() - write_start
+                written += 1
+                if timings is not None:
+                    timings.add(timing)
+            logger.debug("Added {} to output", new_name)
+
+        def finish(name, key, reserved, future):
+            nonlocal failed, outstanding
+            try:
+                new_name, image_data, timing = future.result()
+                write(new_name, image_data, timing)
+                cache.put(key, image_data)
+                get_quotas().charge(session, decoded_bytes=timing.decoded_bytes)
+                if backend == "process":
+                    record_conversion(target_format, timing)
+            except Exception as e:
+                with write_lock:
+                    failed += 1
+                    if failures is not None:
+                        failures.append(FileResult(name, error=str(e)))
+                logger.error("Error adding {} to output: {}", name, e)
+                record_error(name)
+            finally:
+                QUEUE_DEPTH.dec()
+                budget.release(reserved)
+                with idle:
+                    outstanding -= 1
+                    idle.notify_all()
+
+        with (
+            span("stream_conversions", format=target_format, backend=backend),
+            worker_pool(backend, max_workers) as executor,
+        ):
+            try:
+                for i, file in enumerate(files):
+                    submitted += 1
+                    content_hash = (
+                        fingerprints[i] if fingerprints else fingerprint(file)
+                    )
+                    key = make_key(content_hash, target_format, options)
+                    cached = cache.get(key)
+                    if cached is not None:
+                        timing = FileTiming(
+                            file.name,
+                            bytes_in=len(file.getvalue()),
+                            bytes_out=len(cached),
+                            cached=True,
+                        )
+                        write(
+                            ImageConverter.output_name(file.name, target_format),
+                            cached,
+                            timing,
+                        )
+                        continue
+                    reserved = budget.acquire(
+                        ImageProcessor.estimate_decoded_bytes(file)
+                    )
+                    QUEUE_DEPTH.inc()
+                    if backend == "process":
+                        future = executor.submit(
+                            _convert_source,
+                            file.name,
+                            file.getvalue(),
+                            target_format,
+                            options,
+                            current_context(),
+                            current_trace_id(),
+                        )
+                    else:
+                        future = executor.submit(
+                            bind(ImageConverter.convert_file),
+                            file,
+                            target_format,
+                            options,
+                        )
+                    with idle:
+                        outstanding += 1
+                    # Callbacks run on whichever thread finishes the future
+                    future.add_done_callback(
+                        bind(functools.partial(finish, file.name, key, reserved))
+                    )
+            finally:
+                while True:
+                    with idle:
+                        if idle.wait_for(
+                            lambda: outstanding == 0, timeout=STATUS_INTERVAL
+                        ):
+                            break
+                    report_status()
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings.wall = elapsed
+        write_textfile()
+        logger.info(
+            f"Streamed {written}/{submitted} images to {target_format} in "
+            f"{elapsed:.2f} s, {failed} failed"
+        )
+        get_quotas().log_usage(session)
+        return written
+
+    @staticmethod
+    def convert_files_streaming(
+        files,
+        target_format: str,
+        backend: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timings: Optional[BatchTimings] = None,
+        failures: Optional[List[FileResult]] = None,
+        fingerprints: Optional[List[str]] = None,
+    ) -> SpooledArchive:
+        with SpooledArchive(get_settings().zip_spool_bytes) as archive:
+            written = ImageConverter.stream_conversions(
+                files,
+                target_format,
+                archive,
+                backend,
+                max_workers,
+                options,
+                timings,
+                failures,
+                fingerprints,
+            )
+        logger.success(
+            f"ZIP file created successfully ({written} images, {archive.size} bytes)"
+        )
+        return archive
+
+
+# Process backend entry points; module level so the pool can pickle them
+def _encode_from_shared(
+    handle: SharedImageHandle,
+    original_name: str,
+    target_format: str,
+    options: Optional[Dict[str, Any]] = None,
+    trace_context: Optional[SpanContext] = None,
+    trace_id: Optional[str] = None,
+) -> Tuple[str, bytes, FileTiming]:
+    # The pixels were decoded in the parent; attaching them is all that is left
+    with resume(trace_context, trace_id), span("convert", file=original_name):
+        start = time.perf_counter()
+        image = import_image(handle)
+        timing = FileTiming(original_name, decode=time.perf_counter() - start)
+        return ImageConverter.timed_encode(image, timing, target_format, options)
+
+
+def _convert_source(
+    name: str,
+    data: bytes,
+    target_format: str,
+    options: Optional[Dict[str, Any]] = None,
+    trace_context: Optional[SpanContext] = None,
+    trace_id: Optional[str] = None,
+) -> Tuple[str, bytes, FileTiming]:
+    source = io.BytesIO(data)
+    source.name = name
+    with resume(trace_context, trace_id):
+        return ImageConverter.convert_file(source, target_format, options)
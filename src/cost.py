@@ -0,0 +1,29 @@
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Relative cost per megapixel of decoding each source format (as Pillow names
+# it in the header) and of encoding each target format, with Pillow's default
+# settings. Only the ratios matter: they decide the order work is handed out.
+DECODE_COST = {"JPEG": 1.0, "MPO": 1.0, "PNG": 1.5, "WEBP": 2.0, "HEIF": 3.0}
+ENCODE_COST = {"JPEG": 1.0, "PNG": 5.0, "WEBP": 4.0}
+DEFAULT_COST = 2.0
+
+
+def conversion_cost(
+    size: Sequence[int], source_format: str, target_format: str
+) -> float:
+    megapixels = size[0] * size[1] / 1_000_000
+    decode = DECODE_COST.get((source_format or "").upper(), DEFAULT_COST)
+    encode = ENCODE_COST.get(target_format.upper(), DEFAULT_COST)
+    return megapixels * (decode + encode)
+
+
+def longest_first(items: Sequence[T], cost: Callable[[T], float]) -> List[T]:
+    """Order ``items`` by descending estimated cost (LPT scheduling).
+
+    Handing out the most expensive work first keeps a large image from being
+    picked up last and running alone while the other workers idle. Ties keep
+    their original order.
+    """
+    return sorted(items, key=cost, reverse=True)
@@ -0,0 +1,51 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional
+
+from .tracing import span
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def fingerprint(file) -> str:
+    with span("fingerprint", file=file.name):
+        digest = hashlib.blake2b(digest_size=16)
+        # getvalue() hands back the bytes the BytesIO already shares, where
+        # getbuffer() would make it copy them first
+        view = memoryview(file.getvalue())
+        for start in range(0, len(view), CHUNK_SIZE):
+            digest.update(view[start : start + CHUNK_SIZE])
+        return digest.hexdigest()
+
+
+@dataclass
+class UploadDiff:
+    fingerprints: List[str]
+    removed: List[str]
+
+
+def diff_uploads(
+    files, known: Collection[str], memo: Optional[Dict[str, str]] = None
+) -> UploadDiff:
+    # Streamlit gives every upload a stable file_id, so unchanged uploads are
+    # only hashed once per session
+    fingerprints = []
+    file_ids = set()
+    for file in files:
+        file_id = getattr(file, "file_id", None)
+        file_ids.add(file_id)
+        if memo is not None and file_id in memo:
+            content_hash = memo[file_id]
+        else:
+            content_hash = fingerprint(file)
+            if memo is not None and file_id is not None:
+                memo[file_id] = content_hash
+        fingerprints.append(content_hash)
+
+    if memo is not None:
+        for stale_id in memo.keys() - file_ids:
+            del memo[stale_id]
+
+    current = set(fingerprints)
+    removed = [content_hash for content_hash in known if content_hash not in current]
+    return UploadDiff(fingerprints, removed)
@@ -1,95 +1,278 @@
-import concurrent.futures
-import io
-from dataclasses import dataclass
-from pathlib import Path
-from typing import List, Tuple
+import hmac
+import math
+import secrets
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator
 
-import pillow_heif
 import streamlit as st
 from loguru import logger
-from PIL import Image
-
-@dataclass
-class ProcessedImage:
-    original_name: str
-    image: Image.Image
-
-
-class ImageProcessor:
-    @staticmethod
-    def process_heic(file) -> Image.Image:
-        logger.debug(f"Processing HEIC file: {file.name}")
-        heif_file = pillow_heif.read_heif(file)
-        return Image.frombytes(
-            heif_file.mode,
-            heif_file.size,
-            heif_file.data,
-            "raw",
-            heif_file.mode,
-            heif_file.stride,
+
+from .converter import (
+    SUPPORTED_EXTENSIONS,
+    TARGET_FORMATS,
+    ImageConverter,
+    ImageProcessor,
+    get_decoded_cache,
+)
+from .fingerprint import diff_uploads
+from .memory import MemoryReport, memory_stage
+from .profiling import profile
+from .quota import QuotaExceeded
+from .scheduler import QueueStatus, session
+from .settings import PROFILE_MODES, get_settings
+from .thumbnails import get_thumbnails
+from .timing import BatchTimings
+from .tracing import new_trace_id, trace
+
+GALLERY_PAGE_SIZES = [12, 24, 48, 96]
+
+
+@st.fragment
+def render_gallery():
+    # Runs as a fragment, so toggling and paging rerun only the gallery
+    if not st.toggle("Show processed images"):
+        return
+
+    logger.debug("Displaying image gallery")
+    st.subheader("Processed Images")
+    processed_images = st.session_state.processed_images
+
+    size_col, page_col = st.columns(2)
+    with size_col:
+        page_size = st.selectbox(
+            "Images per page", GALLERY_PAGE_SIZES, key="gallery_page_size"
+        )
+    page_count = max(1, math.ceil(len(processed_images) / page_size))
+    # The batch may have shrunk since the page was picked
+    if st.session_state.get("gallery_page", 1) > page_count:
+        st.session_state.gallery_page = page_count
+    with page_col:
+        page = st.number_input(
+            f"Page (of {page_count})",
+            min_value=1,
+            max_value=page_count,
+            step=1,
+            key="gallery_page",
         )
 
-    @staticmethod
-    def process_image(file) -> ProcessedImage:
-        logger.info(f"Processing image: {file.name}")
-        try:
-            if file.name.lower().endswith(".heic"):
-                image = ImageProcessor.process_heic(file)
-            else:
-                image = Image.open(file)
-            logger.success(f"Successfully processed: {file.name}")
-            return ProcessedImage(file.name, image)
-        except Exception as e:
-            logger.error(f"Error processing {file.name}: {str(e)}")
-            raise
-
-    @staticmethod
-    def process_images_parallel(files) -> List[ProcessedImage]:
-        logger.info(f"Starting parallel processing of {len(files)} images")
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            return list(executor.map(ImageProcessor.process_image, files))
-
-
-class ImageConverter:
-    @staticmethod
-    def convert_to_buffer(
-        processed_image: ProcessedImage, target_format: str
-    ) -> Tuple[str, bytes]:
-        img_buffer = io.BytesIO()
-        processed_image.image.save(img_buffer, format=target_format)
-        base_name = Path(processed_image.original_name).stem
-        new_name = f"{base_name}.{target_format.lower()}"
-        return new_name, img_buffer.getvalue()
-
-    @staticmethod
-    def create_zip(processed_images: List[ProcessedImage], target_format: str) -> bytes:
-        logger.info(
-            f"Creating ZIP with {len(processed_images)} images in {target_format} format"
+    start = (page - 1) * page_size
+    page_images = processed_images[start : start + page_size]
+    st.caption(
+        f"Showing {start + 1}–{start + len(page_images)} of {len(processed_images)}"
+    )
+    with session(st.session_state.scheduler_session):
+        thumbnails = get_thumbnails(page_images)
+    cols = st.columns(3)
+    for idx, (proc_image, (thumbnail, error)) in enumerate(
+        zip(page_images, thumbnails)
+    ):
+        with cols[idx % 3]:
+            if thumbnail is None:
+                st.warning(f"**{proc_image.original_name}**: {error}")
+                continue
+            st.image(
+                thumbnail,
+                caption=proc_image.original_name,
+                use_container_width=True,
+            )
+
+
+@contextmanager
+def queue_position() -> Iterator[None]:
+    # Work runs under this session's share of the global scheduler, and its
+    # place in the queue is shown while it waits
+    placeholder = st.empty()
+
+    def show(status: QueueStatus):
+        if status.paused:
+            placeholder.caption(
+                "The server is short of memory, your batch will start as soon as "
+                "it recovers"
+            )
+        elif status.queued and not status.running:
+            placeholder.caption(
+                f"Waiting for a free worker, {status.sessions_ahead} other "
+                f"session(s) ahead of you"
+            )
+        elif status.queued:
+            placeholder.caption(
+                f"{status.running} image(s) converting, {status.queued} queued"
+            )
+        else:
+            placeholder.empty()
+
+    try:
+        with session(st.session_state.scheduler_session, show):
+            yield
+    finally:
+        placeholder.empty()
+
+
+def process_uploads(uploaded_files, fingerprints) -> bool:
+    # Files already processed are reused, so after a failure this retries
+    # only the files that failed
+    try:
+        with (
+            st.spinner("Processing images..."),
+            trace(
+                "process_uploads",
+                trace_id=st.session_state.trace_id,
+                files=len(uploaded_files),
+            ),
+            memory_stage(st.session_state.memory_report, "process_images"),
+            queue_position(),
+        ):
+            results = ImageProcessor.process_images_incremental(
+                uploaded_files, fingerprints, st.session_state.images_by_hash
+            )
+    except QuotaExceeded as e:
+        st.error(str(e))
+        return False
+    st.session_state.processed_images = [r.value for r in results if r.ok]
+    st.session_state.failed_files = {r.name: r.error for r in results if not r.ok}
+    return True
+
+
+def reset_archives():
+    for archive in st.session_state.zip_cache.values():
+        archive.close()
+    st.session_state.zip_cache = {}
+    st.session_state.zip_timings = {}
+    st.session_state.zip_failures = {}
+
+
+def render_failures(failures: Dict[str, str]) -> bool:
+    """List the files that failed; returns whether a retry was requested."""
+    st.warning(f"**{len(failures)}** file(s) could not be converted")
+    with st.expander("Failed files"):
+        for name, error in failures.items():
+            st.markdown(f"- **{name}**: {error}")
+    return st.button("Retry failed files", use_container_width=True)
+
+
+def render_timings(timings: BatchTimings):
+    with st.expander("Timings"):
+        megabytes = 1024 * 1024
+        wall_col, speedup_col, in_col, out_col = st.columns(4)
+        wall_col.metric("Wall time", f"{timings.wall:.2f} s")
+        speedup_col.metric("Parallel speedup", f"{timings.speedup:.1f}×")
+        in_col.metric("Bytes in", f"{timings.bytes_in / megabytes:.1f} MB")
+        out_col.metric("Bytes out", f"{timings.bytes_out / megabytes:.1f} MB")
+
+        decode_col, encode_col, zip_col, download_col = st.columns(4)
+        decode_col.metric("Decode", f"{timings.stage_total('decode'):.2f} s")
+        encode_col.metric("Encode", f"{timings.stage_total('encode'):.2f} s")
+        zip_col.metric("ZIP write", f"{timings.stage_total('zip_write'):.2f} s")
+        download_col.metric("Download prep", f"{timings.download_prep or 0:.2f} s")
+        st.caption(
+            "Stage times are summed over files; speedup is that sum over the wall "
+            "time. Cached files skip decode and encode."
+            + (f" Trace ID: `{timings.trace_id}`" if timings.trace_id else "")
         )
-        zip_buffer = io.BytesIO()
-        from zipfile import ZipFile
-
-        with ZipFile(zip_buffer, "w") as zip_file:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [
-                    executor.submit(
-                        ImageConverter.convert_to_buffer, img, target_format
-                    )
-                    for img in processed_images
-                ]
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        new_name, image_data = future.result()
-                        zip_file.writestr(new_name, image_data)
-                        logger.debug(f"Added {new_name} to ZIP")
-                    except Exception as e:
-                        logger.error(f"Error adding file to ZIP: {str(e)}")
+        st.dataframe(
+            [timing.as_row() for timing in timings.files],
+            hide_index=True,
+            use_container_width=True,
+        )
+
+
+def session_memory(uploaded_files) -> Dict[str, int]:
+    state = st.session_state
+    return {
+        "Uploaded files": sum(len(file.getvalue()) for file in uploaded_files),
+        "Processed images": sum(
+            len(image.data) for image in state.images_by_hash.values()
+        ),
+        "ZIP archives in memory": sum(
+            archive.size for archive in state.zip_cache.values() if not archive.on_disk
+        ),
+        # Shared by every session, so an upper bound for this one
+        "Decoded bitmaps (shared)": get_decoded_cache().stats().bytes,
+    }
+
+
+def render_memory_report(report: MemoryReport):
+    megabytes = 1024 * 1024
+    with st.expander("Memory"):
+        total_col, image_col = st.columns(2)
+        total_col.metric(
+            "Held by session", f"{report.session_total / megabytes:.1f} MB"
+        )
+        image_col.metric("Per image", f"{report.per_image / 1024:.0f} KB")
+        st.dataframe(
+            [
+                {"held by": name, "MB": round(nbytes / megabytes, 2)}
+                for name, nbytes in report.session_bytes.items()
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.dataframe(
+            [
+                {
+                    "stage": stage.stage,
+                    "peak RSS MB": round(stage.peak_rss / megabytes, 1),
+                    "RSS growth MB": round(stage.rss_growth / megabytes, 1),
+                    "traced peak MB": round(stage.traced_peak / megabytes, 2),
+                    "retained MB": round(stage.traced_retained / megabytes, 2),
+                    "retained per image KB": round(
+                        stage.traced_retained / max(report.images, 1) / 1024, 1
+                    ),
+                }
+                for stage in report.stages
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        for stage in report.stages:
+            st.caption(f"Top allocations: {stage.stage}")
+            st.dataframe(
+                [
+                    {
+                        "location": allocation.location,
+                        "KB": round(allocation.size / 1024, 1),
+                        "blocks": allocation.count,
+                    }
+                    for allocation in stage.top_allocations
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+
+
+def requested_profile() -> str:
+    # An admin can profile one conversion with ?profile=<mode>&token=<token>.
+    # The parameters are dropped at once, as the page is usually opened before
+    # anything is uploaded, so the mode is kept in the session until the next
+    # archive is built (see finish_profiled_run)
+    settings = get_settings()
+    params = st.query_params
+    if (
+        settings.profile_token is not None
+        and params.get("profile") in PROFILE_MODES
+        and hmac.compare_digest(
+            params.get("token", "").encode(), settings.profile_token.encode()
+        )
+    ):
+        st.session_state.profile_request = params["profile"]
+        del params["profile"]
+        del params["token"]
+    return st.session_state.get("profile_request", settings.profile)
+
 
-        logger.success("ZIP file created successfully")
-        return zip_buffer.getvalue()
+def finish_profiled_run():
+    if st.session_state.pop("profile_request", None) is not None:
+        logger.info("Profiled conversion finished, profiling switched off")
 
 
 def render_image_converter():
+    mode = requested_profile()
+    with profile(mode, get_settings().profile_dir, "image_converter"):
+        _render_image_converter()
+
+
+def _render_image_converter():
     logger.info("Rendering image converter page")
     st.title("Image Converter")
 
@@ -97,86 +280,189 @@ def render_image_converter():
     if "processed_images" not in st.session_state:
         logger.debug("Initializing session state")
         st.session_state.processed_images = None
-        st.session_state.last_files_processed = None
-        st.session_state.last_format = None
+        st.session_state.images_by_hash = {}
+        st.session_state.fingerprints = {}
+        st.session_state.last_batch = None
         st.session_state.zip_cache = {}
+        st.session_state.zip_timings = {}
+        st.session_state.zip_failures = {}
+        st.session_state.failed_files = {}
+        st.session_state.trace_id = new_trace_id()
+        st.session_state.trace_batch = None
+        st.session_state.memory_report = None
+        st.session_state.scheduler_session = secrets.token_hex(8)
 
     uploaded_files = st.file_uploader(
         "Choose image files",
-        type=["png", "jpg", "jpeg", "webp", "heic"],
+        type=SUPPORTED_EXTENSIONS,
         accept_multiple_files=True,
     )
 
+    # Compare uploads by content, so only new or changed files get processed.
+    # Hashing new uploads is the first stage of their batch, so it is traced
+    # under the ID the batch takes if the uploads turn out to have changed.
+    # Reruns with nothing new to hash open no trace.
+    upload_trace_id = new_trace_id()
+    unhashed = [
+        file
+        for file in uploaded_files or []
+        if getattr(file, "file_id", None) not in st.session_state.fingerprints
+    ]
+    with (
+        trace("diff_uploads", trace_id=upload_trace_id, files=len(unhashed))
+        if unhashed
+        else nullcontext()
+    ):
+        diff = diff_uploads(
+            uploaded_files or [],
+            st.session_state.images_by_hash,
+            st.session_state.fingerprints,
+        )
+    for content_hash in diff.removed:
+        logger.debug("Releasing image {}", content_hash)
+        del st.session_state.images_by_hash[content_hash]
+
     if uploaded_files:
-        target_format = st.selectbox("Convert to:", ["PNG", "JPEG", "WebP"])
-
-        # Check if we need to reprocess the images
-        needs_processing = (
-            st.session_state.processed_images is None
-            or st.session_state.last_files_processed is None
-            or len(uploaded_files) != len(st.session_state.last_files_processed)
-            or any(
-                f1.name != f2.name
-                for f1, f2 in zip(uploaded_files, st.session_state.last_files_processed)
-            )
-            or target_format != st.session_state.last_format
+        target_format = st.selectbox("Convert to:", TARGET_FORMATS)
+
+        batch = tuple(
+            (file.name, content_hash)
+            for file, content_hash in zip(uploaded_files, diff.fingerprints)
+        )
+
+        # Only new files need processing; a format change just runs the encode
+        # stage against the images already held. The streaming pipeline keeps
+        # no images at all and goes straight from uploads to the ZIP.
+        streaming = get_settings().pipeline == "streaming"
+        needs_processing = batch != st.session_state.last_batch or (
+            not streaming and st.session_state.processed_images is None
         )
 
         if needs_processing:
-            # Reset state when files or format change
+            # Reset state when files change
             st.session_state.processed_images = None
-            st.session_state.zip_cache = {}
+            st.session_state.failed_files = {}
+            reset_archives()
+            if batch != st.session_state.trace_batch:
+                st.session_state.trace_id = upload_trace_id
+                st.session_state.trace_batch = batch
+            if get_settings().memory_profile:
+                st.session_state.memory_report = MemoryReport(len(uploaded_files))
 
-            logger.info("Files or format changed, showing conversion button")
+            logger.info("Files changed, showing conversion button")
             st.info(
                 f"Ready to convert **{len(uploaded_files)}** images to: **{target_format}**"
             )
             if st.button("Convert All", type="primary", use_container_width=True):
                 logger.info(f"Starting conversion process to {target_format}")
-                with st.spinner("Processing images..."):
-                    st.session_state.processed_images = (
-                        ImageProcessor.process_images_parallel(uploaded_files)
-                    )
-                    st.session_state.last_files_processed = uploaded_files
-                    st.session_state.last_format = target_format
+                if not streaming and not process_uploads(
+                    uploaded_files, diff.fingerprints
+                ):
+                    return
+                st.session_state.last_batch = batch
 
                 logger.success("Conversion process completed")
                 st.rerun()
 
         # Only show results if processing is complete
-        if st.session_state.processed_images is not None:
-            st.success(
-                f"**{len(uploaded_files)}** images processed and ready for download!"
-            )
+        else:
+            # Filled in once the ZIP stage has reported its failures too
+            summary = st.empty()
+
+            if st.session_state.processed_images:
+                render_gallery()
 
-            if st.toggle("Show processed images"):
-                logger.debug("Displaying image gallery")
-                st.subheader("Processed Images")
-                cols = st.columns(3)
-                for idx, proc_image in enumerate(st.session_state.processed_images):
-                    with cols[idx % 3]:
-                        st.image(
-                            proc_image.image,
-                            caption=proc_image.original_name,
-                            use_container_width=True,
-                        )
+            if not streaming and not st.session_state.processed_images:
+                # Nothing to archive; only the failures are left to show
+                if render_failures(st.session_state.failed_files):
+                    if process_uploads(uploaded_files, diff.fingerprints):
+                        st.rerun()
+                return
 
             # Create ZIP only if needed
             if target_format not in st.session_state.zip_cache:
                 logger.info(f"Creating ZIP for format: {target_format}")
-                with st.spinner("Creating ZIP file..."):
-                    zip_data = ImageConverter.create_zip(
-                        st.session_state.processed_images, target_format
+                timings = BatchTimings(
+                    target_format, trace_id=st.session_state.trace_id
+                )
+                zip_failures = []
+                try:
+                    with (
+                        st.spinner("Creating ZIP file..."),
+                        trace(
+                            "build_archive",
+                            trace_id=st.session_state.trace_id,
+                            format=target_format,
+                        ),
+                        memory_stage(
+                            st.session_state.memory_report,
+                            f"create_zip {target_format}",
+                        ),
+                        queue_position(),
+                    ):
+                        if streaming:
+                            archive = ImageConverter.convert_files_streaming(
+                                uploaded_files,
+                                target_format,
+                                timings=timings,
+                                failures=zip_failures,
+                                fingerprints=diff.fingerprints,
+                            )
+                        else:
+                            archive = ImageConverter.create_zip(
+                                st.session_state.processed_images,
+                                target_format,
+                                timings=timings,
+                                failures=zip_failures,
+                            )
+                        st.session_state.zip_cache[target_format] = archive
+                        st.session_state.zip_timings[target_format] = timings
+                        st.session_state.zip_failures[target_format] = {
+                            failure.name: failure.error for failure in zip_failures
+                        }
+                    finish_profiled_run()
+                except QuotaExceeded as e:
+                    st.error(str(e))
+                    return
+                report = st.session_state.memory_report
+                if report is not None:
+                    report.session_bytes = session_memory(uploaded_files)
+                    path = report.save(get_settings().profile_dir)
+                    logger.info(
+                        f"Session holds {report.session_total} bytes, "
+                        f"{report.per_image} per image; report saved to {path}"
                     )
-                    st.session_state.zip_cache[target_format] = zip_data
             else:
                 logger.info(f"Using cached ZIP for format: {target_format}")
-                zip_data = st.session_state.zip_cache[target_format]
+                archive = st.session_state.zip_cache[target_format]
+                timings = st.session_state.zip_timings[target_format]
 
-            st.download_button(
-                label="Download All Converted Images",
-                data=zip_data,
-                file_name=f"converted_images_{target_format.lower()}.zip",
-                mime="application/zip",
-                use_container_width=True,
-            )
+            failures = {
+                **st.session_state.failed_files,
+                **st.session_state.zip_failures[target_format],
+            }
+            converted = len(uploaded_files) - len(failures)
+            if converted:
+                summary.success(
+                    f"**{converted}** images processed and ready for download!"
+                )
+            if failures and render_failures(failures):
+                # Work that succeeded is reused: processed images stay in the
+                # session and encoded outputs in the shared cache
+                if streaming or process_uploads(uploaded_files, diff.fingerprints):
+                    reset_archives()
+                    st.rerun()
+
+            start = time.perf_counter()
+            with archive.reader() as zip_data:
+                st.download_button(
+                    label="Download All Converted Images",
+                    data=zip_data,
+                    file_name=f"converted_images_{target_format.lower()}.zip",
+                    mime="application/zip",
+                    use_container_width=True,
+                )
+            timings.download_prep = time.perf_counter() - start
+            render_timings(timings)
+            if st.session_state.memory_report is not None:
+                render_memory_report(st.session_state.memory_report)
@@ -0,0 +1,38 @@
+import sys
+from functools import lru_cache
+from typing import Optional
+
+from loguru import logger
+
+from .settings import get_settings
+
+LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "{process} | {extra[trace_id]} | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>"
+)
+
+_level = "INFO"
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """Replace loguru's default handler with a queued stderr sink.
+
+    ``enqueue`` moves formatting and writing off the calling thread, so pool
+    workers only pay for putting the record on a queue.
+    """
+    global _level
+    _level = (level or get_settings().log_level).upper()
+    logger.remove()
+    logger.configure(extra={"trace_id": "-"})
+    logger.add(sys.stderr, level=_level, format=LOG_FORMAT, enqueue=True)
+
+
+def current_level() -> str:
+    return _level
+
+
+@lru_cache(maxsize=None)
+def setup_logging() -> None:
+    # Streamlit reruns the app script, but the sink should be added only once
+    configure_logging()
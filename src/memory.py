@@ -0,0 +1,227 @@
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from .pools import CGROUP_ROOT
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss(pid: Optional[int] = None) -> int:
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return peak_rss() if pid is None else 0
+
+
+def _cgroup_working_set() -> Optional[int]:
+    # Usage minus the inactive page cache the kernel reclaims before it runs
+    # out, as the kubelet counts it. Temporary ZIP files would otherwise look
+    # like pressure.
+    for usage_path, stat_path, inactive_key in (
+        (CGROUP_ROOT / "memory.current", CGROUP_ROOT / "memory.stat", "inactive_file"),
+        (
+            CGROUP_ROOT / "memory/memory.usage_in_bytes",
+            CGROUP_ROOT / "memory/memory.stat",
+            "total_inactive_file",
+        ),
+    ):
+        try:
+            usage = int(usage_path.read_text())
+        except (OSError, ValueError):
+            continue
+        inactive = 0
+        try:
+            for line in stat_path.read_text().splitlines():
+                key, value = line.split()
+                if key == inactive_key:
+                    inactive = int(value)
+                    break
+        except (OSError, ValueError):
+            pass
+        return max(0, usage - inactive)
+    return None
+
+
+def memory_usage() -> int:
+    """Memory counted against the limit: all of it, not just this process.
+
+    The cgroup's working set covers process-pool workers and anything else in
+    the container. Without cgroup accounting, it is this process's RSS plus
+    that of the worker processes it started.
+    """
+    usage = _cgroup_working_set()
+    if usage is not None:
+        return usage
+    children = multiprocessing.active_children()
+    return current_rss() + sum(current_rss(child.pid) for child in children)
+
+
+def memory_limit() -> Optional[int]:
+    """The memory limit of this process's cgroup, v2 or v1, if it has one."""
+    for path in (
+        CGROUP_ROOT / "memory.max",
+        CGROUP_ROOT / "memory/memory.limit_in_bytes",
+    ):
+        try:
+            value = path.read_text().strip()
+        except OSError:
+            continue
+        # v1 reports "no limit" as a huge page-aligned number
+        if value == "max" or int(value) >= 1 << 60:
+            return None
+        return int(value)
+    return None
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakRSSSampler:
+    """Samples the process RSS on a background thread and keeps the highest value.
+
+    ``ru_maxrss`` only ever grows over the process lifetime, so it cannot
+    attribute a peak to one stage of a longer run.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "PeakRSSSampler":
+        self.start_rss = self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self) -> int:
+        return self.peak - self.start_rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+@dataclass
+class Allocation:
+    location: str
+    size: int
+    count: int
+
+
+@dataclass
+class StageMemory:
+    stage: str
+    peak_rss: int
+    rss_growth: int
+    traced_peak: int
+    traced_retained: int
+    top_allocations: List[Allocation]
+
+
+@dataclass
+class MemoryReport:
+    """Per-stage memory of one batch plus what its session holds afterwards.
+
+    tracemalloc only sees Python allocations; Pillow keeps pixel buffers in
+    its own heap, which shows up in the RSS figures instead.
+    """
+
+    images: int
+    stages: List[StageMemory] = field(default_factory=list)
+    session_bytes: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def session_total(self) -> int:
+        return sum(self.session_bytes.values())
+
+    @property
+    def per_image(self) -> int:
+        return self.session_total // max(self.images, 1)
+
+    def save(self, directory: str) -> Path:
+        output = Path(directory)
+        output.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = output / f"memory-{stamp}.json"
+        report = asdict(self)
+        report["session_total"] = self.session_total
+        report["per_image"] = self.per_image
+        path.write_text(json.dumps(report, indent=2))
+        return path
+
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+@contextmanager
+def memory_stage(
+    report: Optional[MemoryReport], stage: str, top: int = 10
+) -> Iterator[None]:
+    """Records peak RSS and the largest new Python allocations of a stage.
+
+    A no-op when ``report`` is None; tracing starts on first use and stays on
+    so later stages can be compared against earlier snapshots.
+    """
+    if report is None:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    traced_start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    try:
+        with PeakRSSSampler() as sampler:
+            yield
+    finally:
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        allocations = [
+            Allocation(str(diff.traceback[0]), diff.size_diff, diff.count_diff)
+            for diff in after.compare_to(before, "lineno")[:top]
+            if diff.size_diff > 0
+        ]
+        result = StageMemory(
+            stage,
+            sampler.peak,
+            sampler.growth,
+            traced_peak - traced_start,
+            traced - traced_start,
+            allocations,
+        )
+        report.stages.append(result)
+        logger.info(
+            f"Memory for {stage}: peak RSS {result.peak_rss} bytes "
+            f"(+{result.rss_growth}), traced peak {result.traced_peak} bytes, "
+            f"{result.traced_retained} bytes still allocated"
+        )
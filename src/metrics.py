@@ -0,0 +1,318 @@
+import bisect
+import os
+import tempfile
+import threading
+from contextlib import contextmanager, suppress
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from .settings import get_settings
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines += [
+            f"{name}{labels} {float(value)!r}" for name, labels, value in self.samples()
+        ]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    # The text format wants HELP, TYPE and the samples under one name, so
+    # counter names carry their _total suffix themselves
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        # Unlabelled metrics are exported as zero before their first update
+        self._values: Dict[LabelValues, float] = {} if labels else {(): 0}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            (self.name, _format_labels(self.labels, key), value)
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {} if labels else {(): 0}
+        self._callbacks: Dict[LabelValues, Callable[[], float]] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set_function(self, function: Callable[[], float], *label_values: str) -> None:
+        # Read at scrape time, so the hot path pays nothing for it
+        with self._lock:
+            self._callbacks[label_values] = function
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for key, function in callbacks.items():
+            values[key] = function()
+        return [
+            (self.name, _format_labels(self.labels, key), value)
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: one count per bucket plus +Inf, then the sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                label_values, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = {
+                key: (list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            }
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        _format_labels(self.labels + ("le",), key + (le,)),
+                        cumulative,
+                    )
+                )
+            samples.append(
+                (f"{self.name}_sum", _format_labels(self.labels, key), total)
+            )
+            samples.append(
+                (f"{self.name}_count", _format_labels(self.labels, key), cumulative)
+            )
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+FILES_CONVERTED = REGISTRY.register(
+    Counter(
+        "st_converter_files_converted_total",
+        "Files decoded and encoded, by target format.",
+        ["format"],
+    )
+)
+DECODE_SECONDS = REGISTRY.register(
+    Histogram(
+        "st_converter_decode_seconds",
+        "Time to decode one upload, by source codec.",
+        ["codec"],
+    )
+)
+ENCODE_SECONDS = REGISTRY.register(
+    Histogram(
+        "st_converter_encode_seconds",
+        "Time to encode one image, by target format.",
+        ["format"],
+    )
+)
+ERRORS = REGISTRY.register(
+    Counter(
+        "st_converter_errors_total",
+        "Files that failed to read, decode or encode, by source codec.",
+        ["codec"],
+    )
+)
+IMAGES_IN_FLIGHT = REGISTRY.register(
+    Gauge(
+        "st_converter_images_in_flight",
+        "Images being decoded or encoded by this process right now.",
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "st_converter_pool_queue_depth",
+        "Conversions submitted to a worker pool and not finished yet.",
+    )
+)
+SCHEDULED_TASKS = REGISTRY.register(
+    Gauge(
+        "st_converter_scheduled_tasks",
+        "Tasks admitted by the fair scheduler, by state (queued or running).",
+        ["state"],
+    )
+)
+MEMORY_PRESSURE = REGISTRY.register(
+    Gauge(
+        "st_converter_memory_pressure_level",
+        "Memory pressure level: 0 normal, 1 elevated, 2 high, 3 critical.",
+    )
+)
+CACHE_BYTES = REGISTRY.register(
+    Gauge("st_converter_cache_bytes", "Bytes held by each shared cache.", ["cache"])
+)
+
+
+def codec(name: str) -> str:
+    extension = name.rsplit(".", 1)[-1].lower()
+    return "jpeg" if extension == "jpg" else extension
+
+
+def record_conversion(target_format: str, timing) -> None:
+    FILES_CONVERTED.inc(target_format)
+    DECODE_SECONDS.observe(timing.decode, codec(timing.name))
+    ENCODE_SECONDS.observe(timing.encode, target_format)
+
+
+def record_error(name: str) -> None:
+    ERRORS.inc(codec(name))
+
+
+@contextmanager
+def track_conversion(name: str) -> Iterator[None]:
+    IMAGES_IN_FLIGHT.inc()
+    try:
+        yield
+    except Exception:
+        record_error(name)
+        raise
+    finally:
+        IMAGES_IN_FLIGHT.dec()
+
+
+def track_cache(label: str, cache) -> None:
+    CACHE_BYTES.set_function(lambda: cache.stats().bytes, label)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@lru_cache(maxsize=None)
+def start_exporter() -> Optional[ThreadingHTTPServer]:
+    port = get_settings().metrics_port
+    if port is None:
+        return None
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    except OSError as e:
+        # Typically another server process already serves this port
+        logger.warning(f"Could not serve metrics on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    return server
+
+
+def write_textfile(path: Optional[str] = None) -> None:
+    # The textfile collector may read at any moment, so replace the file whole
+    path = path or get_settings().metrics_file
+    if not path:
+        return
+    target = Path(path)
+    # Sessions finish batches concurrently, so each write gets its own
+    # temporary file; a failed export must never fail the conversion
+    temporary = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=target.parent, prefix=f".{target.name}.", delete=False
+        ) as temporary:
+            temporary.write(REGISTRY.render())
+        # mkstemp files are private; node_exporter usually runs as another user
+        os.chmod(temporary.name, 0o644)
+        os.replace(temporary.name, target)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {target}: {e}")
+        if temporary is not None:
+            with suppress(OSError):
+                os.unlink(temporary.name)
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from loguru import logger
+
+from .metrics import track_cache
+from .settings import get_settings
+
+CacheKey = Tuple[str, str, Tuple[Tuple[str, Any], ...]]
+
+
+def make_key(
+    content_hash: str, target_format: str, options: Optional[Dict[str, Any]] = None
+) -> CacheKey:
+    return content_hash, target_format.upper(), tuple(sorted((options or {}).items()))
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes: int
+    max_bytes: int
+
+
+class ByteBudgetLRU:
+    """Thread-safe LRU bounded by the total ``sizeof`` of its values."""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return data
+
+    def put(self, key: Hashable, data: Any) -> None:
+        size = self.sizeof(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self._bytes -= self._sizes.pop(key)
+            self._entries[key] = data
+            self._sizes[key] = size
+            self._bytes += size
+            self._evict(self.max_bytes)
+
+    def shrink(self, max_bytes: int) -> int:
+        # Frees memory now without lowering the budget, so the cache refills
+        # once the pressure is gone; returns the bytes evicted
+        with self._lock:
+            return self._evict(max_bytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def _evict(self, max_bytes: int) -> int:
+        freed = 0
+        while self._bytes > max_bytes and self._entries:
+            key, _ = self._entries.popitem(last=False)
+            size = self._sizes.pop(key)
+            self._bytes -= size
+            self._evictions += 1
+            freed += size
+        if freed:
+            logger.debug("Cache evicted {} bytes", freed)
+        return freed
+
+
+@lru_cache(maxsize=None)
+def get_output_cache() -> ByteBudgetLRU:
+    cache = ByteBudgetLRU(get_settings().output_cache_bytes)
+    track_cache("output", cache)
+    return cache
@@ -0,0 +1,107 @@
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from loguru import logger
+
+from .logs import configure_logging, current_level
+from .settings import BACKENDS, get_settings
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    # cgroup v2 exposes "<quota> <period>" or "max <period>" in cpu.max; v1
+    # splits them over two files, with -1 meaning no quota
+    try:
+        quota, period = (CGROUP_ROOT / "cpu.max").read_text().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    for directory in ("cpu", "cpu,cpuacct"):
+        try:
+            quota = int((CGROUP_ROOT / directory / "cpu.cfs_quota_us").read_text())
+            period = int((CGROUP_ROOT / directory / "cpu.cfs_period_us").read_text())
+        except (OSError, ValueError):
+            continue
+        return None if quota <= 0 else quota / period
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use, unlike ``os.cpu_count()``.
+
+    Takes the smaller of the CPU affinity mask and the cgroup CPU quota, so a
+    container limited to 4 CPUs on a 64-core host gets 4.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+
+def default_workers() -> int:
+    return get_settings().max_workers or available_cpus()
+
+
+def create_executor(
+    backend: str, max_workers: Optional[int] = None
+) -> concurrent.futures.Executor:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "process":
+        # Streamlit runs scripts on threads, so forking the server is not safe.
+        # Spawned workers start with loguru's default DEBUG handler, so give
+        # them the parent's level and queued sink.
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_logging,
+            initargs=(current_level(),),
+        )
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="converter"
+    )
+
+
+_pools: Dict[str, concurrent.futures.Executor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(backend: str) -> concurrent.futures.Executor:
+    """Long-lived pool of ``default_workers()``, shared by every session.
+
+    Callers must wait for their own futures; shutting the pool down would
+    break it for everyone else.
+    """
+    with _pools_lock:
+        pool = _pools.get(backend)
+        # A crashed worker process breaks its pool for good; start a new one
+        if pool is None or getattr(pool, "_broken", False):
+            workers = default_workers()
+            pool = _pools[backend] = create_executor(backend, workers)
+            logger.info(f"Started shared {backend} pool with {workers} workers")
+        return pool
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def start_workers(pool: concurrent.futures.Executor, workers: int) -> None:
+    # Workers start lazily, one per submission while none is idle, so submit
+    # one task per worker to pay for spawning them up front
+    for future in [pool.submit(_ready) for _ in range(workers)]:
+        future.result()
+
+
+def warm_pool(backend: str) -> None:
+    start_workers(get_pool(backend), default_workers())
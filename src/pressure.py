@@ -0,0 +1,130 @@
+import threading
+from functools import lru_cache
+from typing import Optional
+
+from loguru import logger
+
+from .archive import spill_archives
+from .memory import memory_limit, memory_usage
+from .metrics import MEMORY_PRESSURE
+from .output_cache import get_output_cache
+from .scheduler import get_scheduler
+from .settings import get_settings
+
+LEVELS = ("normal", "elevated", "high", "critical")
+# Share of the memory limit in use at which each level above normal starts
+THRESHOLDS = (0.75, 0.85, 0.95)
+# A level is left only once usage is this far below where it starts
+HYSTERESIS = 0.05
+INTERVAL = 1.0
+
+
+def pressure_level(ratio: float, current: int) -> int:
+    level = sum(ratio >= threshold for threshold in THRESHOLDS)
+    # On the way down, stop at the highest level whose release point usage is
+    # still above
+    while current > level and ratio < THRESHOLDS[current - 1] - HYSTERESIS:
+        current -= 1
+    return max(level, current)
+
+
+class MemoryPressureMonitor:
+    """Sheds memory as usage nears the memory limit, and recovers.
+
+    Usage is the cgroup's working set when the cgroup reports it, so pool
+    worker processes count too; see ``memory.memory_usage``.
+
+    elevated
+        halves the decoded-image LRU on every check
+    high
+        empties the decoded-image LRU, halves the output and thumbnail
+        caches, moves finished in-memory archives to disk and halves the
+        scheduler's concurrency
+    critical
+        also empties the output and thumbnail caches, runs one task at a time
+        and holds new batches back until the pressure drops
+    """
+
+    def __init__(self, limit: int, interval: float = INTERVAL):
+        self.limit = limit
+        self.interval = interval
+        self.level = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="memory-pressure", daemon=True
+        )
+
+    def start(self) -> "MemoryPressureMonitor":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception(f"Memory pressure check failed: {e}")
+
+    def check(self) -> int:
+        usage = memory_usage()
+        level = pressure_level(usage / self.limit, self.level)
+        if level != self.level:
+            log = logger.warning if level > self.level else logger.info
+            log(
+                f"Memory pressure {LEVELS[self.level]} -> {LEVELS[level]} "
+                f"({usage} of {self.limit} bytes in use)"
+            )
+            self._set_level(level)
+        if level:
+            self._shed(level)
+        return level
+
+    def _set_level(self, level: int) -> None:
+        self.level = level
+        scheduler = get_scheduler()
+        limit = (scheduler.capacity, scheduler.capacity, scheduler.capacity // 2, 1)
+        if scheduler.limit != limit[level]:
+            scheduler.set_limit(limit[level])
+            logger.info(f"Scheduler concurrency set to {scheduler.limit}")
+        if level == len(LEVELS) - 1:
+            scheduler.pause()
+            logger.warning("Paused admission of new batches")
+        elif scheduler.paused:
+            scheduler.resume()
+            logger.info("Resumed admission of new batches")
+
+    def _shed(self, level: int) -> None:
+        # Imported here so that starting the monitor does not load the codecs
+        from .converter import get_decoded_cache
+        from .thumbnails import get_thumbnail_cache
+
+        decoded = get_decoded_cache()
+        caches = {"output": get_output_cache(), "thumbnail": get_thumbnail_cache()}
+        freed = {
+            "decoded": decoded.shrink(decoded.stats().bytes // 2 if level == 1 else 0)
+        }
+        if level >= 2:
+            for name, cache in caches.items():
+                freed[name] = cache.shrink(
+                    0 if level == 3 else cache.stats().bytes // 2
+                )
+            freed["archives"] = spill_archives()
+        for name, size in freed.items():
+            if size:
+                logger.info(f"Memory pressure: freed {size} bytes from {name}")
+
+
+@lru_cache(maxsize=None)
+def start_pressure_monitor() -> Optional[MemoryPressureMonitor]:
+    limit = get_settings().memory_limit_bytes or memory_limit()
+    if limit is None:
+        logger.info("No memory limit found, memory pressure monitor not started")
+        return None
+    logger.info(f"Watching memory use against a limit of {limit} bytes")
+    monitor = MemoryPressureMonitor(limit).start()
+    MEMORY_PRESSURE.set_function(lambda: monitor.level)
+    return monitor
@@ -0,0 +1,89 @@
+import cProfile
+import datetime
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from loguru import logger
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class StackSampler:
+    """Samples the stacks of every thread into collapsed-stack counts.
+
+    Unlike ``cProfile`` this also sees the pool threads doing the decoding and
+    encoding, and its cost does not grow with the number of calls.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "StackSampler":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: Path) -> None:
+        # One "frame;frame;frame count" line per stack, as flamegraph.pl and
+        # speedscope read it
+        path.write_text(
+            "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+        )
+
+
+@contextmanager
+def profile(mode: str, directory: str, label: str) -> Iterator[None]:
+    if mode == "off":
+        yield
+        return
+    output = Path(directory)
+    output.mkdir(parents=True, exist_ok=True)
+    stem = f"{label}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+    if mode == "cprofile":
+        # Deterministic, but only sees the calling thread
+        profiler = cProfile.Profile()
+        path = output / f"{stem}.prof"
+    else:
+        profiler = StackSampler()
+        path = output / f"{stem}.collapsed"
+    try:
+        with profiler:
+            yield
+    finally:
+        if mode == "cprofile":
+            profiler.dump_stats(path)
+        else:
+            profiler.write_collapsed(path)
+        logger.info(f"Saved {mode} profile to {path}")
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+from loguru import logger
+
+from .settings import get_settings
+
+# Work outside any app session, like the CLI's, is not metered
+DEFAULT_SESSION = "-"
+# Sessions are only ever added, so keep the most recently charged ones
+MAX_SESSIONS = 10_000
+
+
+class QuotaExceeded(Exception):
+    """Raised when a session past its hard quota starts another conversion."""
+
+
+@dataclass
+class Usage:
+    cpu_seconds: float = 0.0
+    decoded_bytes: int = 0
+    since: float = field(default_factory=time.monotonic)
+
+
+@dataclass(frozen=True)
+class Limits:
+    cpu_seconds: Optional[float] = None
+    decoded_bytes: Optional[int] = None
+
+    def exceeded_by(self, usage: Usage) -> bool:
+        return (
+            self.cpu_seconds is not None and usage.cpu_seconds >= self.cpu_seconds
+        ) or (
+            self.decoded_bytes is not None and usage.decoded_bytes >= self.decoded_bytes
+        )
+
+
+class QuotaTracker:
+    """CPU seconds and decoded bytes charged to each session.
+
+    Usage is counted over a window that starts with a session's first charge.
+    Past the ``soft`` limits a session's work is deprioritized and encoded with
+    faster settings; past the ``hard`` limits new conversions are refused until
+    the window ends.
+    """
+
+    def __init__(self, soft: Limits, hard: Limits, window: float):
+        self.soft = soft
+        self.hard = hard
+        self.window = window
+        self._usage: "OrderedDict[str, Usage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current(self, session: str) -> Optional[Usage]:
+        usage = self._usage.get(session)
+        if usage is None or time.monotonic() - usage.since >= self.window:
+            return None
+        return usage
+
+    def charge(
+        self, session: str, cpu_seconds: float = 0.0, decoded_bytes: int = 0
+    ) -> None:
+        if session == DEFAULT_SESSION:
+            return
+        with self._lock:
+            usage = self._current(session)
+            if usage is None:
+                usage = self._usage[session] = Usage()
+            usage.cpu_seconds += cpu_seconds
+            usage.decoded_bytes += decoded_bytes
+            self._usage.move_to_end(session)
+            if len(self._usage) > MAX_SESSIONS:
+                self._usage.popitem(last=False)
+
+    def usage(self, session: str) -> Usage:
+        with self._lock:
+            usage = self._current(session)
+            if usage is None:
+                return Usage()
+            return Usage(usage.cpu_seconds, usage.decoded_bytes, usage.since)
+
+    def over_soft(self, session: str) -> bool:
+        return self.soft.exceeded_by(self.usage(session))
+
+    def check(self, session: str) -> None:
+        usage = self.usage(session)
+        if not self.hard.exceeded_by(usage):
+            return
+        wait = max(0.0, self.window - (time.monotonic() - usage.since))
+        logger.warning(f"Refusing conversion for session {session}: hard quota")
+        raise QuotaExceeded(
+            f"This session has used its conversion quota "
+            f"({self.describe(usage)}). "
+            f"Try again in {wait / 60:.0f} minutes."
+        )
+
+    def describe(self, usage: Usage) -> str:
+        def limits(soft, hard) -> str:
+            def limit(value) -> str:
+                if value is None:
+                    return "unlimited"
+                return f"{value:g}" if isinstance(value, float) else str(value)
+
+            return f"soft {limit(soft)}, hard {limit(hard)}"
+
+        return (
+            f"{usage.cpu_seconds:.2f} CPU s "
+            f"({limits(self.soft.cpu_seconds, self.hard.cpu_seconds)}), "
+            f"{usage.decoded_bytes} decoded bytes "
+            f"({limits(self.soft.decoded_bytes, self.hard.decoded_bytes)})"
+        )
+
+    def log_usage(self, session: str) -> None:
+        if session == DEFAULT_SESSION:
+            return
+        usage = self.usage(session)
+        state = (
+            "over hard quota"
+            if self.hard.exceeded_by(usage)
+            else "over soft quota" if self.soft.exceeded_by(usage) else "within quota"
+        )
+        logger.info(
+            f"Session {session} used {self.describe(usage)} "
+            f"in the current window, {state}"
+        )
+
+
+@lru_cache(maxsize=None)
+def get_quotas() -> QuotaTracker:
+    settings = get_settings()
+    return QuotaTracker(
+        soft=Limits(settings.quota_cpu_soft, settings.quota_decoded_soft_bytes),
+        hard=Limits(settings.quota_cpu_hard, settings.quota_decoded_hard_bytes),
+        window=settings.quota_window,
+    )
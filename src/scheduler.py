@@ -0,0 +1,293 @@
+import concurrent.futures
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from typing import Callable, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+from loguru import logger
+
+from .metrics import SCHEDULED_TASKS
+from .pools import create_executor, default_workers, get_pool, start_workers
+from .quota import DEFAULT_SESSION, QuotaTracker, get_quotas
+from .settings import get_settings
+
+STATUS_INTERVAL = 0.5
+
+
+@dataclass
+class QueueStatus:
+    queued: int = 0
+    running: int = 0
+    # Sessions that get a worker before this one's next task does
+    sessions_ahead: int = 0
+    # New batches are held back while the server is short of memory
+    paused: bool = False
+
+
+StatusCallback = Callable[[QueueStatus], None]
+
+_session: contextvars.ContextVar[Tuple[str, Optional[StatusCallback]]] = (
+    contextvars.ContextVar("scheduler_session", default=(DEFAULT_SESSION, None))
+)
+_dedicated: contextvars.ContextVar[
+    Optional[Tuple[str, int, concurrent.futures.Executor]]
+] = contextvars.ContextVar("dedicated_pool", default=None)
+
+
+@dataclass
+class _Task:
+    future: concurrent.futures.Future
+    backend: str
+    function: Callable
+    args: tuple
+    kwargs: dict
+
+
+def _measured(function: Callable, args: tuple, kwargs: dict):
+    # Runs in the worker, thread or process, to time the CPU the task used
+    start = time.thread_time()
+    try:
+        return function(*args, **kwargs), None, time.thread_time() - start
+    except Exception as e:
+        return None, e, time.thread_time() - start
+
+
+class FairScheduler:
+    """Admits work from every session to the shared pools, round-robin.
+
+    At most ``limit`` tasks run at once across all sessions. Each session has
+    its own FIFO queue and a free slot goes to the next session in turn, so a
+    large batch cannot starve a small one that arrives after it. The CPU time
+    of each task is charged to its session's quota.
+    """
+
+    def __init__(self, limit: int, quotas: QuotaTracker):
+        self.capacity = limit
+        self.limit = limit
+        self.quotas = quotas
+        self._admitting = threading.Event()
+        self._admitting.set()
+        self._queues: "OrderedDict[str, Deque[_Task]]" = OrderedDict()
+        self._running: Dict[str, int] = {}
+        self._active = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._dispatch, name="scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self, session: str, backend: str, function: Callable, *args, **kwargs
+    ) -> concurrent.futures.Future:
+        task = _Task(concurrent.futures.Future(), backend, function, args, kwargs)
+        with self._condition:
+            self._queues.setdefault(session, deque()).append(task)
+            self._condition.notify()
+        return task.future
+
+    def set_limit(self, limit: int) -> None:
+        # Running tasks finish; fewer are started until the limit is raised
+        with self._condition:
+            self.limit = max(1, min(limit, self.capacity))
+            self._condition.notify_all()
+
+    @property
+    def paused(self) -> bool:
+        return not self._admitting.is_set()
+
+    def pause(self) -> None:
+        self._admitting.clear()
+
+    def resume(self) -> None:
+        self._admitting.set()
+
+    def wait_admitted(self) -> None:
+        # Holds a new batch back while admission is paused; queued and running
+        # tasks are not affected
+        while not self._admitting.wait(STATUS_INTERVAL):
+            report_status()
+
+    def status(self, session: str) -> QueueStatus:
+        with self._condition:
+            queue = self._queues.get(session)
+            sessions = list(self._queues)
+            return QueueStatus(
+                queued=len(queue) if queue else 0,
+                running=self._running.get(session, 0),
+                sessions_ahead=sessions.index(session) if queue else 0,
+                paused=self.paused,
+            )
+
+    def queued(self) -> int:
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def running(self) -> int:
+        return self._active
+
+    def _next(self) -> Tuple[str, _Task]:
+        # The first session in turn gets one task, then goes to the back.
+        # Sessions past their soft quota only get a slot when no one else waits.
+        for session, queue in self._queues.items():
+            if not self.quotas.over_soft(session):
+                break
+        else:
+            session, queue = next(iter(self._queues.items()))
+        task = queue.popleft()
+        if queue:
+            self._queues.move_to_end(session)
+        else:
+            del self._queues[session]
+        return session, task
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._queues and self._active < self.limit
+                )
+                session, task = self._next()
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                self._active += 1
+                self._running[session] = self._running.get(session, 0) + 1
+            try:
+                inner = get_pool(task.backend).submit(
+                    _measured, task.function, task.args, task.kwargs
+                )
+            except Exception as e:
+                self._release(session)
+                task.future.set_exception(e)
+                continue
+            inner.add_done_callback(partial(self._finish, session, task.future))
+
+    def _release(self, session: str) -> None:
+        with self._condition:
+            self._active -= 1
+            self._running[session] -= 1
+            if not self._running[session]:
+                del self._running[session]
+            self._condition.notify()
+
+    def _finish(
+        self,
+        session: str,
+        outer: concurrent.futures.Future,
+        inner: concurrent.futures.Future,
+    ) -> None:
+        # Free the slot first, so the next task starts while this result is used
+        self._release(session)
+        error = inner.exception()
+        if error is None:
+            result, error, cpu_seconds = inner.result()
+            self.quotas.charge(session, cpu_seconds=cpu_seconds)
+        if error is not None:
+            outer.set_exception(error)
+        else:
+            outer.set_result(result)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> FairScheduler:
+    limit = get_settings().max_concurrency or default_workers()
+    scheduler = FairScheduler(limit, get_quotas())
+    SCHEDULED_TASKS.set_function(scheduler.queued, "queued")
+    SCHEDULED_TASKS.set_function(scheduler.running, "running")
+    logger.info(f"Started scheduler with {limit} concurrent tasks")
+    return scheduler
+
+
+class SessionExecutor(concurrent.futures.Executor):
+    """Executor view of the scheduler for one session and backend."""
+
+    def __init__(self, scheduler: FairScheduler, backend: str, session: str):
+        self.scheduler = scheduler
+        self.backend = backend
+        self.session = session
+
+    def submit(self, function, /, *args, **kwargs) -> concurrent.futures.Future:
+        return self.scheduler.submit(
+            self.session, self.backend, function, *args, **kwargs
+        )
+
+
+@contextmanager
+def session(
+    session_id: str, on_status: Optional[StatusCallback] = None
+) -> Iterator[None]:
+    """Attribute work submitted in this context to ``session_id``.
+
+    ``on_status`` is called from the waiting thread with the session's place
+    in the queue while it waits on its results.
+    """
+    token = _session.set((session_id, on_status))
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def current_session() -> str:
+    return _session.get()[0]
+
+
+def report_status() -> None:
+    session_id, on_status = _session.get()
+    if on_status is not None:
+        on_status(get_scheduler().status(session_id))
+
+
+def as_completed(
+    futures: Iterable[concurrent.futures.Future],
+) -> Iterator[concurrent.futures.Future]:
+    # concurrent.futures.as_completed, reporting the queue position while it waits
+    pending = set(futures)
+    while pending:
+        report_status()
+        done, pending = concurrent.futures.wait(
+            pending,
+            timeout=STATUS_INTERVAL,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        yield from done
+
+
+@contextmanager
+def dedicated_pool(
+    backend: str, max_workers: int
+) -> Iterator[concurrent.futures.Executor]:
+    """Start a pool of ``max_workers`` outside the scheduler, all workers up.
+
+    Within this context, ``worker_pool`` calls for the same backend and size
+    use it instead of starting a cold pool each. The benchmarks run every
+    worker count this way, so none of them is timed with spawn costs or on
+    the shared pool.
+    """
+    with create_executor(backend, max_workers) as executor:
+        start_workers(executor, max_workers)
+        token = _dedicated.set((backend, max_workers, executor))
+        try:
+            yield executor
+        finally:
+            _dedicated.reset(token)
+
+
+@contextmanager
+def worker_pool(
+    backend: str, max_workers: Optional[int] = None
+) -> Iterator[concurrent.futures.Executor]:
+    # Asking for a worker count, as benchmarks and the CLI do, bypasses the
+    # scheduler: it gets the enclosing dedicated_pool or a pool of its own
+    if max_workers is None:
+        yield SessionExecutor(get_scheduler(), backend, current_session())
+        return
+    dedicated = _dedicated.get()
+    if dedicated is not None and dedicated[:2] == (backend, max_workers):
+        yield dedicated[2]
+        return
+    with create_executor(backend, max_workers) as executor:
+        yield executor
@@ -0,0 +1,113 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+BACKENDS = ("thread", "process")
+PIPELINES = ("staged", "streaming")
+PROFILE_MODES = ("off", "sample", "cprofile")
+ORDERINGS = ("cost", "upload")
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def _env_choice(name: str, default: str, choices) -> str:
+    value = os.environ.get(name, default).lower()
+    if value not in choices:
+        raise ValueError(
+            f"Unknown {name} value {value!r}, expected one of: {', '.join(choices)}"
+        )
+    return value
+
+
+def _env_str(name: str) -> Optional[str]:
+    return os.environ.get(name) or None
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ("1", "true", "yes", "on")
+
+
+def _env_mb(name: str, default: Optional[int]) -> Optional[int]:
+    value = _env_int(name)
+    return value * 1024 * 1024 if value is not None else default
+
+
+@dataclass(frozen=True)
+class Settings:
+    backend: str = "thread"
+    max_workers: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    zip_spool_bytes: int = 64 * 1024 * 1024
+    output_cache_bytes: int = 256 * 1024 * 1024
+    decoded_cache_bytes: int = 256 * 1024 * 1024
+    thumbnail_cache_bytes: int = 64 * 1024 * 1024
+    pipeline: str = "staged"
+    pipeline_memory_bytes: int = 1024 * 1024 * 1024
+    metrics_port: Optional[int] = None
+    metrics_file: Optional[str] = None
+    trace_file: Optional[str] = None
+    profile: str = "off"
+    profile_dir: str = "profiles"
+    profile_token: Optional[str] = None
+    memory_profile: bool = False
+    log_level: str = "INFO"
+    quota_cpu_soft: Optional[float] = None
+    quota_cpu_hard: Optional[float] = None
+    quota_decoded_soft_bytes: Optional[int] = None
+    quota_decoded_hard_bytes: Optional[int] = None
+    quota_window: int = 3600
+    memory_limit_bytes: Optional[int] = None
+    order: str = "cost"
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            backend=_env_choice("ST_CONVERTER_BACKEND", cls.backend, BACKENDS),
+            max_workers=_env_int("ST_CONVERTER_WORKERS"),
+            max_concurrency=_env_int("ST_CONVERTER_CONCURRENCY"),
+            zip_spool_bytes=_env_mb("ST_CONVERTER_ZIP_SPOOL_MB", cls.zip_spool_bytes),
+            output_cache_bytes=_env_mb("ST_CONVERTER_CACHE_MB", cls.output_cache_bytes),
+            decoded_cache_bytes=_env_mb(
+                "ST_CONVERTER_DECODED_CACHE_MB", cls.decoded_cache_bytes
+            ),
+            thumbnail_cache_bytes=_env_mb(
+                "ST_CONVERTER_THUMBNAIL_CACHE_MB", cls.thumbnail_cache_bytes
+            ),
+            pipeline=_env_choice("ST_CONVERTER_PIPELINE", cls.pipeline, PIPELINES),
+            pipeline_memory_bytes=_env_mb(
+                "ST_CONVERTER_PIPELINE_MB", cls.pipeline_memory_bytes
+            ),
+            metrics_port=_env_int("ST_CONVERTER_METRICS_PORT"),
+            metrics_file=_env_str("ST_CONVERTER_METRICS_FILE"),
+            trace_file=_env_str("ST_CONVERTER_TRACE_FILE"),
+            profile=_env_choice("ST_CONVERTER_PROFILE", cls.profile, PROFILE_MODES),
+            profile_dir=_env_str("ST_CONVERTER_PROFILE_DIR") or cls.profile_dir,
+            profile_token=_env_str("ST_CONVERTER_PROFILE_TOKEN"),
+            memory_profile=_env_flag("ST_CONVERTER_MEMORY_PROFILE"),
+            log_level=os.environ.get("ST_CONVERTER_LOG_LEVEL", cls.log_level).upper(),
+            quota_cpu_soft=_env_float("ST_CONVERTER_QUOTA_CPU_SOFT"),
+            quota_cpu_hard=_env_float("ST_CONVERTER_QUOTA_CPU_HARD"),
+            quota_decoded_soft_bytes=_env_mb(
+                "ST_CONVERTER_QUOTA_DECODED_SOFT_MB", None
+            ),
+            quota_decoded_hard_bytes=_env_mb(
+                "ST_CONVERTER_QUOTA_DECODED_HARD_MB", None
+            ),
+            quota_window=_env_int("ST_CONVERTER_QUOTA_WINDOW") or cls.quota_window,
+            memory_limit_bytes=_env_mb("ST_CONVERTER_MEMORY_LIMIT_MB", None),
+            order=_env_choice("ST_CONVERTER_ORDER", cls.order, ORDERINGS),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    return Settings.from_env()
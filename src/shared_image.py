@@ -0,0 +1,62 @@
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class SharedImageHandle:
+    """Picklable reference to raw pixels parked in a shared memory block."""
+
+    shm_name: str
+    mode: str
+    size: Tuple[int, int]
+    nbytes: int
+    palette: Optional[List[int]] = None
+    info: dict = field(default_factory=dict)
+
+
+def export_image(image: Image.Image) -> SharedImageHandle:
+    data = image.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        shm.buf[: len(data)] = data
+    except Exception:
+        shm.close()
+        shm.unlink()
+        raise
+    # POSIX keeps the segment alive until it is unlinked, so the mapping can go
+    shm.close()
+    return SharedImageHandle(
+        shm_name=shm.name,
+        mode=image.mode,
+        size=image.size,
+        nbytes=len(data),
+        palette=image.getpalette() if image.mode in ("P", "PA") else None,
+        info=dict(image.info),
+    )
+
+
+def import_image(handle: SharedImageHandle, unlink: bool = False) -> Image.Image:
+    shm = shared_memory.SharedMemory(name=handle.shm_name)
+    try:
+        with shm.buf[: handle.nbytes] as view:
+            image = Image.frombytes(handle.mode, handle.size, view)
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    if handle.palette is not None:
+        image.putpalette(handle.palette)
+    image.info.update(handle.info)
+    return image
+
+
+def release(handle: SharedImageHandle) -> None:
+    try:
+        shm = shared_memory.SharedMemory(name=handle.shm_name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
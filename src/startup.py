@@ -0,0 +1,118 @@
+import importlib
+import io
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from loguru import logger
+
+from .settings import get_settings
+
+# Modules a fresh server process imports, from the cheapest entry point up
+APP_MODULES = [
+    "src.homepage",
+    "src.converter",
+    "src.thumbnails",
+    "src.image_converter",
+    "src.cli",
+]
+
+ImportTime = Tuple[str, int, int, int]
+
+
+@contextmanager
+def _step(timings: Dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def warm_up() -> Dict[str, float]:
+    """Import the codec modules, run every codec once and start the pools.
+
+    Returns the seconds spent per step, so slow starts can be attributed.
+    """
+    timings = {}
+    with _step(timings, "import converter"):
+        converter = importlib.import_module(".converter", __package__)
+        importlib.import_module(".thumbnails", __package__)
+    with _step(timings, "pillow plugins"):
+        from PIL import Image
+
+        Image.init()
+    with _step(timings, "libheif"):
+        import pillow_heif
+
+        pillow_heif.libheif_info()
+    with _step(timings, "codecs"):
+        # The first save and load of each format initializes its codec library
+        sample = Image.new("RGB", (8, 8))
+        for target_format in converter.TARGET_FORMATS:
+            data = converter.ImageConverter.encode(sample, target_format)
+            Image.open(io.BytesIO(data)).load()
+    with _step(timings, "pools"):
+        pools = importlib.import_module(".pools", __package__)
+        pools.warm_pool("thread")
+        if get_settings().backend == "process":
+            pools.warm_pool("process")
+    logger.info(
+        "Warm-up finished in {:.2f} s ({})",
+        sum(timings.values()),
+        ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()),
+    )
+    return timings
+
+
+@lru_cache(maxsize=None)
+def start_warm_up() -> threading.Thread:
+    # Once per server process; sessions can be served while it runs
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def import_times(module: str) -> List[ImportTime]:
+    """Import ``module`` in a fresh interpreter and parse ``-X importtime``.
+
+    Returns ``(name, depth, self_us, cumulative_us)`` per imported module, in
+    the order the interpreter finished importing them.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).resolve().parent.parent,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        # Names are indented by two spaces per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return times
+
+
+def import_report(modules: List[str] = APP_MODULES, top: int = 5) -> str:
+    lines = []
+    for module in modules:
+        children = []
+        for name, depth, _, cumulative in import_times(module):
+            if depth == 1:
+                children.append((name, cumulative))
+            elif depth == 0 and name != module:
+                children = []
+            elif depth == 0:
+                lines.append(f"{module}: {cumulative / 1000:.1f} ms")
+                break
+        # The direct imports that cost the most, each with everything it pulled in
+        for name, cumulative in sorted(children, key=lambda child: -child[1])[:top]:
+            lines.append(f"    {name:<32}{cumulative / 1000:>8.1f} ms")
+    return "\n".join(lines)
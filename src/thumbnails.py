@@ -0,0 +1,87 @@
+import io
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from PIL import Image
+
+from .metrics import track_cache
+from .output_cache import ByteBudgetLRU
+from .scheduler import worker_pool
+from .settings import get_settings
+
+THUMBNAIL_SIZE = 320
+
+
+def decode_reduced(name: str, data: bytes, max_size: int) -> Image.Image:
+    source = io.BytesIO(data)
+    if name.lower().endswith(".heic"):
+        import pillow_heif
+
+        heif_file = pillow_heif.open_heif(source)
+        # Prefer the smallest embedded preview that is still big enough.
+        # info["thumbnails"] lists the bounding-box size of each one.
+        boxes = [
+            (box, index)
+            for index, box in enumerate(heif_file.info["thumbnails"])
+            if box >= max_size
+        ]
+        if boxes:
+            _, index = min(boxes)
+            primary = heif_file[heif_file.primary_index]
+            return primary.get_thumbnail(index).to_pillow()
+        return heif_file.to_pillow()
+    image = Image.open(source)
+    # JPEG can decode straight at 1/2, 1/4 or 1/8 scale; other formats ignore this
+    image.draft(None, (max_size, max_size))
+    return image
+
+
+def make_thumbnail(name: str, data: bytes, max_size: int = THUMBNAIL_SIZE) -> bytes:
+    image = decode_reduced(name, data, max_size)
+    image.thumbnail((max_size, max_size), reducing_gap=2.0)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=80)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_thumbnail_cache() -> ByteBudgetLRU:
+    cache = ByteBudgetLRU(get_settings().thumbnail_cache_bytes)
+    track_cache("thumbnail", cache)
+    return cache
+
+
+def get_thumbnail(processed_image, max_size: int = THUMBNAIL_SIZE) -> bytes:
+    cache = get_thumbnail_cache()
+    key = (processed_image.content_hash, max_size)
+    thumbnail = cache.get(key)
+    if thumbnail is None:
+        thumbnail = make_thumbnail(
+            processed_image.original_name, processed_image.data, max_size
+        )
+        cache.put(key, thumbnail)
+    return thumbnail
+
+
+def get_thumbnails(
+    processed_images, max_size: int = THUMBNAIL_SIZE
+) -> List[Tuple[Optional[bytes], Optional[str]]]:
+    """Thumbnail or error per image, in order.
+
+    Only headers are read when a batch is processed, so a file with corrupt
+    pixel data first fails here; it must not take the rest of the page down.
+    """
+
+    def attempt(image) -> Tuple[Optional[bytes], Optional[str]]:
+        try:
+            return get_thumbnail(image, max_size), None
+        except Exception as e:
+            logger.warning("Could not make thumbnail of {}: {}", image.original_name, e)
+            return None, str(e)
+
+    with worker_pool("thread") as executor:
+        return list(executor.map(attempt, processed_images))
@@ -0,0 +1,64 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class FileTiming:
+    """Seconds spent on one file in each stage, plus its size on either side."""
+
+    name: str
+    decode: float = 0.0
+    encode: float = 0.0
+    zip_write: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    decoded_bytes: int = 0
+    cached: bool = False
+
+    @property
+    def total(self) -> float:
+        return self.decode + self.encode + self.zip_write
+
+    def as_row(self) -> Dict:
+        return {
+            "file": self.name,
+            "decode ms": round(self.decode * 1000, 1),
+            "encode ms": round(self.encode * 1000, 1),
+            "zip write ms": round(self.zip_write * 1000, 1),
+            "bytes in": self.bytes_in,
+            "bytes out": self.bytes_out,
+            "cached": self.cached,
+        }
+
+
+@dataclass
+class BatchTimings:
+    """Per-file timings for one conversion batch and the wall time it took."""
+
+    target_format: str
+    files: List[FileTiming] = field(default_factory=list)
+    wall: float = 0.0
+    download_prep: Optional[float] = None
+    trace_id: Optional[str] = None
+
+    def add(self, timing: FileTiming) -> None:
+        self.files.append(timing)
+
+    def stage_total(self, stage: str) -> float:
+        return sum(getattr(timing, stage) for timing in self.files)
+
+    @property
+    def bytes_in(self) -> int:
+        return sum(timing.bytes_in for timing in self.files)
+
+    @property
+    def bytes_out(self) -> int:
+        return sum(timing.bytes_out for timing in self.files)
+
+    @property
+    def speedup(self) -> float:
+        # Time the files kept some worker busy over the time the batch took;
+        # 1.0 means no overlap at all
+        if not self.wall:
+            return 0.0
+        return sum(timing.total for timing in self.files) / self.wall
@@ -0,0 +1,198 @@
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, Optional, TextIO, Tuple
+
+from loguru import logger
+
+from .settings import get_settings
+
+# (trace_id, span_id) of the innermost open span
+SpanContext = Tuple[str, str]
+
+_current: contextvars.ContextVar[Optional[SpanContext]] = contextvars.ContextVar(
+    "span_context", default=None
+)
+# Set by trace() whether or not spans are recorded
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "trace_id", default=None
+)
+_write_lock = threading.Lock()
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def _attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # OTLP JSON carries 64-bit integers as strings
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    parent_span_id: Optional[str]
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: secrets.token_hex(8))
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int = 0
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+            "status": (
+                {"code": 2, "message": self.error} if self.error else {"code": 1}
+            ),
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+@lru_cache(maxsize=None)
+def _trace_file(path: str) -> TextIO:
+    # One append-mode handle per process; each span is a single write, so lines
+    # from worker processes sharing the file do not interleave
+    return open(path, "a", buffering=1)
+
+
+def _export(span: Span) -> None:
+    # One OTLP/JSON ExportTraceServiceRequest per line, as the OpenTelemetry
+    # Collector's file exporter writes and its otlpjsonfile receiver reads
+    record = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        _attribute("service.name", "st-converter"),
+                        _attribute("process.pid", os.getpid()),
+                    ]
+                },
+                "scopeSpans": [
+                    {"scope": {"name": "st-converter"}, "spans": [span.to_otlp()]}
+                ],
+            }
+        ]
+    }
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    with _write_lock:
+        _trace_file(get_settings().trace_file).write(line)
+
+
+@contextmanager
+def _open_span(
+    name: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict
+) -> Iterator[Span]:
+    span = Span(name, trace_id, parent_span_id, attributes)
+    token = _current.set((trace_id, span.span_id))
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)
+        raise
+    finally:
+        _current.reset(token)
+        span.end_ns = time.time_ns()
+        _export(span)
+
+
+@contextmanager
+def trace(
+    name: str, trace_id: Optional[str] = None, **attributes: Any
+) -> Iterator[Optional[Span]]:
+    """Open the root span of a batch and bind its trace ID into the log context.
+
+    Spans are only recorded when ``ST_CONVERTER_TRACE_FILE`` is set; the trace
+    ID is bound either way.
+    """
+    trace_id = trace_id or new_trace_id()
+    token = _trace_id.set(trace_id)
+    try:
+        with logger.contextualize(trace_id=trace_id):
+            if get_settings().trace_file is None:
+                yield None
+                return
+            with _open_span(name, trace_id, None, attributes) as root:
+                yield root
+    finally:
+        _trace_id.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    # Outside a recorded trace this is a no-op
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _open_span(name, parent[0], parent[1], attributes) as child:
+        yield child
+
+
+def current_context() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+@contextmanager
+def resume(
+    context: Optional[SpanContext], trace_id: Optional[str] = None
+) -> Iterator[None]:
+    """Continue the parent's trace in a worker process.
+
+    ``trace_id`` is passed on its own because there is no span context unless
+    spans are recorded, yet the worker's log lines should carry the ID anyway.
+    """
+    if trace_id is None and context is not None:
+        trace_id = context[0]
+    if trace_id is None:
+        yield
+        return
+    if get_settings().trace_file is None:
+        context = None
+    span_token = _current.set(context)
+    id_token = _trace_id.set(trace_id)
+    try:
+        with logger.contextualize(trace_id=trace_id):
+            yield
+    finally:
+        _trace_id.reset(id_token)
+        _current.reset(span_token)
+
+
+def bind(function: Callable) -> Callable:
+    """Run ``function`` in the caller's trace and log context from a pool thread."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
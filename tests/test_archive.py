@@ -0,0 +1,22 @@
+import zipfile
+
+import pytest
+
+from src.archive import SpooledArchive
+
+
+@pytest.mark.parametrize("max_memory, on_disk", [(1 << 20, False), (16, True)])
+def test_reader_starts_at_the_beginning(max_memory, on_disk):
+    with SpooledArchive(max_memory) as archive:
+        archive.writestr("a.txt", b"hello" * 100)
+    assert archive.on_disk == on_disk
+    assert archive.size > 0
+
+    for _ in range(2):
+        with archive.reader() as reader:
+            data = reader.read()
+        assert len(data) == archive.size
+        assert data.startswith(b"PK\x03\x04")
+    with archive.reader() as reader, zipfile.ZipFile(reader) as zip_file:
+        assert zip_file.read("a.txt") == b"hello" * 100
+    archive.close()
@@ -0,0 +1,113 @@
+import io
+
+import pytest
+from PIL import Image
+
+from src import converter as converter_module
+from src.converter import ImageConverter, ImageProcessor
+from src.fingerprint import fingerprint
+
+
+def upload(name: str, data: bytes) -> io.BytesIO:
+    file = io.BytesIO(data)
+    file.name = name
+    return file
+
+
+def png(color: str) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 3), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    # Names of the files actually probed, rather than reused from ``known``
+    names = []
+    process_image = ImageProcessor.process_image
+
+    def spy(file, content_hash=None):
+        names.append(file.name)
+        return process_image(file, content_hash)
+
+    monkeypatch.setattr(ImageProcessor, "process_image", staticmethod(spy))
+    return names
+
+
+def test_incremental_keeps_good_results_and_retries_failures(processed):
+    files = [
+        upload("red.png", png("red")),
+        upload("broken.png", b"not an image"),
+        upload("blue.png", png("blue")),
+    ]
+    fingerprints = [fingerprint(file) for file in files]
+    known = {}
+
+    results = ImageProcessor.process_images_incremental(files, fingerprints, known)
+    assert [result.name for result in results] == ["red.png", "broken.png", "blue.png"]
+    assert [result.ok for result in results] == [True, False, True]
+    assert results[1].error
+    assert results[0].value.size == (4, 3)
+    assert results[0].value.content_hash == fingerprints[0]
+    assert set(known) == {fingerprints[0], fingerprints[2]}
+    assert sorted(processed) == ["blue.png", "broken.png", "red.png"]
+
+    processed.clear()
+    results = ImageProcessor.process_images_incremental(files, fingerprints, known)
+    assert processed == ["broken.png"]
+    assert [result.ok for result in results] == [True, False, True]
+    assert set(known) == {fingerprints[0], fingerprints[2]}
+
+
+def test_incremental_renames_duplicate_uploads(processed):
+    files = [upload("red.png", png("red")), upload("copy.png", png("red"))]
+    fingerprints = [fingerprint(file) for file in files]
+    assert fingerprints[0] == fingerprints[1]
+    known = {}
+
+    results = ImageProcessor.process_images_incremental(files, fingerprints, known)
+    assert processed == ["red.png"]
+    assert [result.name for result in results] == ["red.png", "copy.png"]
+    assert [result.value.original_name for result in results] == [
+        "red.png",
+        "copy.png",
+    ]
+    assert results[1].value.data == results[0].value.data
+    assert len(known) == 1
+
+    # A later upload of the same bytes under another name is not probed again
+    processed.clear()
+    renamed = [upload("again.png", png("red"))]
+    results = ImageProcessor.process_images_incremental(
+        renamed, [fingerprint(renamed[0])], known
+    )
+    assert processed == []
+    assert results[0].value.original_name == "again.png"
+
+
+class Sink(dict):
+    def writestr(self, name, data):
+        self[name] = data
+
+
+def test_streaming_reuses_known_fingerprints(monkeypatch):
+    files = [upload("green.png", png("green")), upload("broken.png", b"not an image")]
+    fingerprints = [fingerprint(file) for file in files]
+
+    def unexpected(file):
+        raise AssertionError(f"{file.name} was hashed again")
+
+    monkeypatch.setattr(converter_module, "fingerprint", unexpected)
+    sink = Sink()
+    failures = []
+    written = ImageConverter.stream_conversions(
+        files,
+        "WebP",
+        sink,
+        backend="thread",
+        failures=failures,
+        fingerprints=fingerprints,
+    )
+    assert written == 1
+    assert list(sink) == ["green.webp"]
+    assert [failure.name for failure in failures] == ["broken.png"]
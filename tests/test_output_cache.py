@@ -0,0 +1,81 @@
+from src.output_cache import ByteBudgetLRU, make_key
+
+
+def test_evicts_least_recently_used_first():
+    cache = ByteBudgetLRU(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    stats = cache.stats()
+    assert (stats.entries, stats.bytes, stats.evictions) == (2, 8, 1)
+
+
+def test_replacing_a_key_counts_its_size_once():
+    cache = ByteBudgetLRU(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("a", b"aaaaaa")
+    assert cache.stats().bytes == 6
+    assert cache.get("a") == b"aaaaaa"
+
+
+def test_refuses_entries_larger_than_the_budget():
+    cache = ByteBudgetLRU(max_bytes=10)
+    cache.put("small", b"ss")
+    cache.put("large", b"x" * 11)
+
+    assert cache.get("large") is None
+    assert cache.get("small") == b"ss"
+    assert cache.stats().evictions == 0
+
+
+def test_custom_sizeof():
+    cache = ByteBudgetLRU(max_bytes=100, sizeof=lambda value: value * 10)
+    cache.put("a", 6)
+    cache.put("b", 6)
+    assert cache.get("a") is None
+    assert cache.stats().bytes == 60
+
+
+def test_shrink_frees_memory_but_keeps_the_budget():
+    cache = ByteBudgetLRU(max_bytes=12)
+    for key in "abc":
+        cache.put(key, key.encode() * 4)
+
+    assert cache.shrink(4) == 8
+    assert cache.get("c") == b"cccc"
+    assert cache.get("a") is None
+    assert cache.stats().max_bytes == 12
+
+    # The cache refills up to its full budget afterwards
+    cache.put("d", b"dddd")
+    cache.put("e", b"eeee")
+    assert cache.stats().bytes == 12
+
+
+def test_clear_keeps_counters():
+    cache = ByteBudgetLRU(max_bytes=10)
+    cache.put("a", b"a")
+    cache.get("a")
+    cache.get("missing")
+    cache.clear()
+    stats = cache.stats()
+    assert (stats.entries, stats.bytes, stats.hits, stats.misses) == (0, 0, 1, 1)
+
+
+def test_key_depends_on_format_and_options():
+    base = make_key("hash", "webp", {"quality": 80})
+
+    assert base == make_key("hash", "WEBP", {"quality": 80})
+    assert base != make_key("hash", "PNG", {"quality": 80})
+    assert base != make_key("other", "WEBP", {"quality": 80})
+    assert base != make_key("hash", "WEBP", {"quality": 60})
+    assert base != make_key("hash", "WEBP")
+    assert make_key("hash", "WEBP", {"quality": 80, "method": 4}) == make_key(
+        "hash", "WEBP", {"method": 4, "quality": 80}
+    )
+    assert make_key("hash", "PNG") == make_key("hash", "PNG", {})
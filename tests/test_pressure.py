@@ -0,0 +1,25 @@
+import pytest
+
+from src.pressure import pressure_level
+
+
+@pytest.mark.parametrize(
+    "ratio, current, expected",
+    [
+        (0.50, 0, 0),
+        (0.80, 0, 1),
+        (0.90, 1, 2),
+        (0.97, 0, 3),
+        # Within the hysteresis band the current level is kept
+        (0.72, 1, 1),
+        (0.91, 3, 3),
+        # Below the band the level drops, but only as far as usage allows
+        (0.84, 3, 2),
+        (0.79, 3, 1),
+        (0.69, 3, 0),
+        (0.79, 2, 1),
+        (0.69, 1, 0),
+    ],
+)
+def test_pressure_level(ratio, current, expected):
+    assert pressure_level(ratio, current) == expected
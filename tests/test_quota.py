@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from src.quota import DEFAULT_SESSION, Limits, QuotaExceeded, QuotaTracker
+
+
+def make_tracker(window: float = 3600) -> QuotaTracker:
+    return QuotaTracker(
+        soft=Limits(cpu_seconds=1.0, decoded_bytes=100),
+        hard=Limits(cpu_seconds=2.0),
+        window=window,
+    )
+
+
+def test_soft_limit_is_reached_by_either_resource():
+    tracker = make_tracker()
+    tracker.charge("cpu", cpu_seconds=0.5)
+    assert not tracker.over_soft("cpu")
+    tracker.charge("cpu", cpu_seconds=0.5)
+    assert tracker.over_soft("cpu")
+
+    tracker.charge("memory", decoded_bytes=100)
+    assert tracker.over_soft("memory")
+    assert not tracker.over_soft("idle")
+
+
+def test_hard_limit_refuses_new_conversions():
+    tracker = make_tracker()
+    tracker.charge("a", cpu_seconds=1.5)
+    tracker.check("a")
+    tracker.charge("a", cpu_seconds=0.5, decoded_bytes=42)
+
+    with pytest.raises(QuotaExceeded) as excinfo:
+        tracker.check("a")
+    assert str(excinfo.value) == (
+        "This session has used its conversion quota "
+        "(2.00 CPU s (soft 1, hard 2), "
+        "42 decoded bytes (soft 100, hard unlimited)). "
+        "Try again in 60 minutes."
+    )
+    # Other sessions are unaffected
+    tracker.check("b")
+
+
+def test_usage_resets_when_the_window_ends():
+    tracker = make_tracker(window=0.05)
+    tracker.charge("a", cpu_seconds=5.0)
+    assert tracker.over_soft("a")
+    with pytest.raises(QuotaExceeded):
+        tracker.check("a")
+
+    time.sleep(0.1)
+    assert tracker.usage("a").cpu_seconds == 0.0
+    assert not tracker.over_soft("a")
+    tracker.check("a")
+
+    # The next charge starts a new window
+    tracker.charge("a", cpu_seconds=0.5)
+    assert tracker.usage("a").cpu_seconds == 0.5
+
+
+def test_default_session_is_not_charged():
+    tracker = make_tracker()
+    tracker.charge(DEFAULT_SESSION, cpu_seconds=100.0, decoded_bytes=10**9)
+    usage = tracker.usage(DEFAULT_SESSION)
+    assert (usage.cpu_seconds, usage.decoded_bytes) == (0.0, 0)
+    assert not tracker.over_soft(DEFAULT_SESSION)
+    tracker.check(DEFAULT_SESSION)
+
+
+def test_no_limits_are_never_exceeded():
+    tracker = QuotaTracker(Limits(), Limits(), window=3600)
+    tracker.charge("a", cpu_seconds=1e6, decoded_bytes=10**12)
+    assert not tracker.over_soft("a")
+    tracker.check("a")
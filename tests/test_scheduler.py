@@ -0,0 +1,147 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from src import scheduler as scheduler_module
+from src.quota import Limits, QuotaTracker
+from src.scheduler import FairScheduler
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # More workers than any limit below, so only the scheduler holds tasks back
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    monkeypatch.setattr(scheduler_module, "get_pool", lambda backend: executor)
+    yield executor
+    executor.shutdown()
+
+
+def make_scheduler(limit: int, soft: Limits = Limits()) -> FairScheduler:
+    return FairScheduler(limit, QuotaTracker(soft, Limits(), window=3600))
+
+
+def hold(scheduler: FairScheduler):
+    # Occupies the only slot until the returned event is set, so tasks
+    # submitted meanwhile queue up in a known state
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(TIMEOUT)
+
+    future = scheduler.submit("blocker", "thread", blocker)
+    assert started.wait(TIMEOUT)
+    return release, future
+
+
+def test_sessions_get_interleaved_slots(pool):
+    scheduler = make_scheduler(1)
+    release, blocker = hold(scheduler)
+    order = []
+    futures = [
+        scheduler.submit(session, "thread", order.append, f"{session}{i}")
+        for session, count in (("a", 3), ("b", 2))
+        for i in range(count)
+    ]
+    release.set()
+    concurrent.futures.wait([blocker, *futures], timeout=TIMEOUT)
+    assert order == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_session_over_soft_quota_goes_last(pool):
+    scheduler = make_scheduler(1, soft=Limits(cpu_seconds=1.0))
+    scheduler.quotas.charge("heavy", cpu_seconds=5.0)
+    release, blocker = hold(scheduler)
+    order = []
+    futures = [
+        scheduler.submit(session, "thread", order.append, name)
+        for session, name in (("heavy", "h0"), ("heavy", "h1"), ("light", "l0"))
+    ]
+    release.set()
+    concurrent.futures.wait([blocker, *futures], timeout=TIMEOUT)
+    assert order == ["l0", "h0", "h1"]
+
+
+def test_limit_is_never_exceeded(pool):
+    scheduler = make_scheduler(2)
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+
+    def task():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+
+    futures = [scheduler.submit(f"s{i % 3}", "thread", task) for i in range(12)]
+    concurrent.futures.wait(futures, timeout=TIMEOUT)
+    assert all(future.done() for future in futures)
+    assert peak <= 2
+    assert scheduler.running() == 0
+
+
+def test_set_limit_is_clamped_to_capacity(pool):
+    scheduler = make_scheduler(4)
+    scheduler.set_limit(100)
+    assert scheduler.limit == 4
+    scheduler.set_limit(0)
+    assert scheduler.limit == 1
+
+
+def test_failing_task_fails_only_its_own_future(pool):
+    scheduler = make_scheduler(2)
+
+    def fail():
+        raise ValueError("boom")
+
+    good = [scheduler.submit("a", "thread", pow, 2, i) for i in range(3)]
+    bad = scheduler.submit("a", "thread", fail)
+    assert [future.result(TIMEOUT) for future in good] == [1, 2, 4]
+    with pytest.raises(ValueError, match="boom"):
+        bad.result(TIMEOUT)
+    # The slot of the failed task is released
+    assert scheduler.submit("b", "thread", pow, 3, 2).result(TIMEOUT) == 9
+
+
+def test_status_reports_queue_position(pool):
+    scheduler = make_scheduler(1)
+    release, blocker = hold(scheduler)
+    futures = [scheduler.submit("a", "thread", int) for _ in range(2)]
+    futures.append(scheduler.submit("b", "thread", int))
+
+    assert scheduler.status("blocker").running == 1
+    assert scheduler.status("a").queued == 2
+    assert scheduler.status("a").sessions_ahead == 0
+    assert scheduler.status("b").queued == 1
+    assert scheduler.status("b").sessions_ahead == 1
+    assert scheduler.status("idle").queued == 0
+    assert scheduler.queued() == 3
+
+    release.set()
+    concurrent.futures.wait([blocker, *futures], timeout=TIMEOUT)
+    assert scheduler.queued() == 0
+
+
+def test_wait_admitted_blocks_while_paused(pool):
+    scheduler = make_scheduler(1)
+    scheduler.pause()
+    assert scheduler.paused
+    admitted = threading.Event()
+    waiter = threading.Thread(
+        target=lambda: (scheduler.wait_admitted(), admitted.set())
+    )
+    waiter.start()
+    assert not admitted.wait(0.1)
+    scheduler.resume()
+    assert admitted.wait(TIMEOUT)
+    waiter.join(TIMEOUT)
+    assert not scheduler.paused